@@ -0,0 +1,475 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import clone
+
+from data_generator import DataGenerator
+from data_processor import SUMMARY_COLUMNS, DataProcessor
+from forest_inference import FlatForest
+from headcount_lookup import HeadcountLookup
+from model_optimal_headcount import ModelOptimalHeadcount
+from prediction_service import read_http_message
+
+# Visualisation modules that headless entry points must not load at import time
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'plotly', 'IPython', 'graphviz', 'pydot']
+
+# Modules used by headless data-processing and prediction runs
+HEADLESS_MODULES = ['main', 'data_processor', 'model_optimal_headcount', 'forest_inference', 'headcount_lookup',
+                    'prediction_service']
+
+
+def tile_df(df:pd.DataFrame, n_rows:int) -> pd.DataFrame:
+    """
+    Repeats the rows of a dataframe until it has n_rows rows.
+    Returns: Pandas dataframe
+    """
+    reps = int(np.ceil(n_rows / len(df)))
+    positions = np.tile(np.arange(len(df)), reps)[:n_rows]
+    return df.iloc[positions].reset_index(drop=True)
+
+
+def to_legacy_dtypes(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts a processed dataframe back to the original dtypes (object strings, int64 and float64).
+    Returns: Pandas dataframe
+    """
+    df_legacy = df.copy()
+    for column in ['site', 'period_of_day', 'profitability']:
+        df_legacy[column] = df_legacy[column].astype(str).astype(object)
+    df_legacy['headcount'] = df_legacy['headcount'].astype(np.int64)
+    for column in df_legacy.select_dtypes('floating').columns:
+        df_legacy[column] = df_legacy[column].astype(np.float64)
+    return df_legacy
+
+
+def report_profitability(filepath:str, n_rows:int, legacy_rows:int, float_dtype:str):
+    """
+    Memory and throughput report for the profitability labelling and compact dtypes.
+    The row-wise apply is only timed on the first legacy_rows rows, since it does not scale.
+    """
+    data_processor = DataProcessor(filepath, float_dtype=float_dtype)
+    df = tile_df(data_processor.df_training_extended, n_rows)
+    df_legacy = to_legacy_dtypes(df)
+
+    # Memory footprint
+    mem_legacy = df_legacy.memory_usage(deep=True).sum() / 1e6
+    mem_compact = df.memory_usage(deep=True).sum() / 1e6
+
+    # Throughput of the labelling step
+    sample = df_legacy.head(legacy_rows)
+    start = time.perf_counter()
+    labels_legacy = sample.apply(data_processor.check_profitability, axis=1)
+    time_legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    labels = data_processor.label_profitability(df['avg_profit_per_headcount'])
+    time_vectorized = time.perf_counter() - start
+
+    identical = bool((labels.head(legacy_rows).astype(str).to_numpy() == labels_legacy.to_numpy()).all())
+
+    print(f"\nProfitability labelling report ({n_rows:,} rows, {float_dtype} money columns)")
+    print(f"  -> Memory (legacy dtypes):  {mem_legacy:10.1f} MB")
+    print(f"  -> Memory (compact dtypes): {mem_compact:10.1f} MB ({mem_legacy / mem_compact:.1f}x smaller)")
+    print(f"  -> Row-wise apply:   {len(sample) / time_legacy:14,.0f} rows/s (on {len(sample):,} rows)")
+    print(f"  -> Vectorized:       {len(df) / time_vectorized:14,.0f} rows/s (on {len(df):,} rows)")
+    print(f"  -> Identical labels: {identical}")
+
+
+def load_or_train_model(filepath:str, model_path:str) -> ModelOptimalHeadcount:
+    """
+    Loads the saved model artifact, or trains and saves one if it does not exist yet.
+    """
+    if os.path.exists(model_path):
+        return ModelOptimalHeadcount.load(model_path)
+    data_processor = DataProcessor(filepath)
+    model = ModelOptimalHeadcount(data_processor.df_training_optimal_prof, random_state=0)
+    model.save(model_path)
+    return model
+
+
+def scenario_grid(model:ModelOptimalHeadcount, n_rows:int, seed:int=0) -> pd.DataFrame:
+    """
+    Random site x period x sales scenarios, encoded as model features.
+    """
+    rng = np.random.default_rng(seed)
+    sites = rng.choice(list(model.site_to_num), n_rows)
+    periods = rng.choice(list(model.period_of_day_to_num), n_rows)
+    sales = rng.uniform(0, 500, n_rows).round(2)
+    return model.features(sites, periods, sales)
+
+
+def time_calls(predict, X:pd.DataFrame, batch_size:int) -> tuple:
+    """
+    Scores X in batches of batch_size rows.
+    Returns: Predictions, median latency per call (s), throughput (rows/s)
+    """
+    predictions, latencies = [], []
+    start = time.perf_counter()
+    for i in range(0, len(X), batch_size):
+        call_start = time.perf_counter()
+        predictions.append(predict(X.iloc[i:i + batch_size]))
+        latencies.append(time.perf_counter() - call_start)
+    total = time.perf_counter() - start
+    return np.concatenate(predictions), float(np.median(latencies)), len(X) / total
+
+
+def report_inference(filepath:str, model_path:str, n_rows:int, batch_sizes:list):
+    """
+    Latency and throughput of the flat forest against sklearn's predict, for several batch sizes.
+    """
+    model = load_or_train_model(filepath, model_path)
+    flat_forest = FlatForest.from_model(model)
+    X = scenario_grid(model, n_rows)
+    X_values = X.to_numpy(dtype=np.float64)
+
+    cells = f"{np.prod(flat_forest.cell_shape):,} cells" if flat_forest.cell_class is not None else "no cell table"
+    print(f"\nInference report ({n_rows:,} scenarios, {len(flat_forest.roots)} trees, depth {flat_forest.max_depth}, "
+          f"{cells})")
+    print(f"  {'batch':>9} | {'sklearn latency':>15} {'rows/s':>12} | {'flat latency':>13} {'rows/s':>12} | identical")
+    for batch_size in batch_sizes:
+        # Small batches are timed on a subset, row by row scoring does not scale
+        n_timed = min(n_rows, batch_size * 200)
+        y_sklearn, lat_sklearn, tput_sklearn = time_calls(model.model.predict, X.head(n_timed), batch_size)
+        y_flat, lat_flat, tput_flat = time_calls(lambda df: flat_forest.predict(df.to_numpy(dtype=np.float64)),
+                                                 X.head(n_timed), batch_size)
+        identical = bool((y_sklearn == y_flat).all())
+        print(f"  {batch_size:>9,} | {lat_sklearn * 1e3:>12.3f} ms {tput_sklearn:>12,.0f} | "
+              f"{lat_flat * 1e3:>10.3f} ms {tput_flat:>12,.0f} | {identical}")
+
+    identical_all = bool((model.model.predict(X) == flat_forest.predict(X_values)).all())
+    print(f"  -> Identical predictions on all {n_rows:,} scenarios: {identical_all}")
+
+
+def report_lookup(filepath:str, model_path:str, n_rows:int, steps:list):
+    """
+    Build time, size, query throughput and disagreement with the model of the headcount lookup table,
+    for several sales resolutions.
+    """
+    model = load_or_train_model(filepath, model_path)
+    rng = np.random.default_rng(0)
+    sites = rng.choice(list(model.site_to_num), n_rows)
+    periods = rng.choice(list(model.period_of_day_to_num), n_rows)
+    sales = rng.uniform(0, 600, n_rows).round(2)
+
+    start = time.perf_counter()
+    y_model = model.predict_headcount(sites, periods, sales)
+    tput_model = n_rows / (time.perf_counter() - start)
+
+    print(f"\nLookup table report ({n_rows:,} queries, model: {tput_model:,.0f} rows/s)")
+    print(f"  {'step':>6} | {'build':>8} | {'size':>9} | {'rows/s':>12} | {'disagreement':>12}")
+    for step in steps:
+        start = time.perf_counter()
+        lookup = HeadcountLookup(model, sales_min=0, sales_max=600, step=step)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        y_lookup = lookup.predict_headcount(sites, periods, sales)
+        tput_lookup = n_rows / (time.perf_counter() - start)
+
+        disagreement = float(np.mean(y_lookup != y_model))
+        print(f"  {step:>6} | {build_time:>6.2f} s | {lookup.table.nbytes / 1e3:>6.1f} kB | "
+              f"{tput_lookup:>12,.0f} | {disagreement:>11.3%}")
+
+
+def report_imports(modules:list, repeat:int, max_seconds:float) -> bool:
+    """
+    Import time of each module in a fresh interpreter (best of repeat runs), and the heavy
+    visualisation modules it pulls in. A module fails if it loads any of HEAVY_MODULES or
+    takes longer than max_seconds to import.
+    Returns: True if all modules passed
+    """
+    code = ("import sys, time; start = time.perf_counter(); import {module}; "
+            "print(time.perf_counter() - start); print(' '.join(m for m in {heavy} if m in sys.modules))")
+
+    print(f"\nImport time report (best of {repeat} runs, limit {max_seconds} s)")
+    passed = True
+    for module in modules:
+        timings = []
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, '-c', code.format(module=module, heavy=HEAVY_MODULES)],
+                                    capture_output=True, text=True, check=True)
+            seconds, heavy = result.stdout.split('\n')[:2]
+            timings.append(float(seconds))
+        ok = not heavy and min(timings) <= max_seconds
+        passed = passed and ok
+        print(f"  {module:>25} | {min(timings):6.2f} s | heavy: {heavy or '-':<30} | {'ok' if ok else 'FAIL'}")
+    return passed
+
+
+def run_step(results:list, scale:dict, step:str, func, trace_memory:bool):
+    """
+    Runs one pipeline step, recording its wall time and (with trace_memory) the peak memory it allocates.
+    Returns: Output of func
+    """
+    if trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    output = func()
+    seconds = time.perf_counter() - start
+    peak_mb = (tracemalloc.get_traced_memory()[1] - baseline) / 1e6 if trace_memory else None
+
+    results.append({**scale, 'step': step, 'seconds': round(seconds, 4),
+                    'peak_mb': None if peak_mb is None else round(peak_mb, 2)})
+    print(f"  {scale['rows']:>10,} | {step:>8} | {seconds:8.3f} s | "
+          f"{'-' if peak_mb is None else f'{peak_mb:8.1f} MB':>11}")
+    return output
+
+
+def benchmark_scale(filepath:str, scale:dict, plot_dir:str, n_iter:int, trace_memory:bool) -> list:
+    """
+    Times every pipeline step on one generated dataset: load, clean, extend, filter, describe,
+    hyperparameter search (model training with search), train (refit of the best forest on all the optimal rows),
+    predict (every extended row in one batch) and plot (when plot_dir is given).
+    Returns: List of step results
+    """
+    results = []
+    data_processor = DataProcessor(filepath)
+    run_step(results, scale, 'load', lambda: data_processor.df_training_raw, trace_memory)
+    run_step(results, scale, 'clean', lambda: data_processor.df_training_clean, trace_memory)
+    df_extended = run_step(results, scale, 'extend', lambda: data_processor.df_training_extended, trace_memory)
+    df_optimal = run_step(results, scale, 'filter', lambda: data_processor.df_training_optimal_prof, trace_memory)
+    run_step(results, scale, 'describe', lambda: data_processor.describe_columns(SUMMARY_COLUMNS), trace_memory)
+
+    model = run_step(results, scale, 'search',
+                     lambda: ModelOptimalHeadcount(df_optimal, n_iter=n_iter, random_state=0, verbose=False),
+                     trace_memory)
+    X = model.features(df_optimal['site'], df_optimal['period_of_day'], df_optimal['sales'])
+    run_step(results, scale, 'train', lambda: clone(model.model).fit(X, df_optimal['headcount']), trace_memory)
+    run_step(results, scale, 'predict',
+             lambda: model.predict_headcount(df_extended['site'], df_extended['period_of_day'], df_extended['sales']),
+             trace_memory)
+
+    if plot_dir is not None:
+        # Only load the plotting stack when plots are benchmarked
+        from data_plotter import DataPlotter
+
+        plotter = DataPlotter(df_extended, output_dir=plot_dir, partitions=data_processor.partition_index())
+        run_step(results, scale, 'plot', plotter.plot_all, trace_memory)
+    return results
+
+
+def report_suite(source:str, days:list, n_sites:int, n_periods:int, output:str, n_iter:int,
+                 plot:bool, trace_memory:bool) -> dict:
+    """
+    End-to-end benchmark of the pipeline on synthetic data (see DataGenerator) at several scales.
+    Results are written to output as JSON, one record per scale and step, so runs can be diffed across versions.
+    Peak memory is what tracemalloc sees (Python objects and numpy buffers, not the native allocations of
+    other libraries, e.g. sklearn's tree nodes). Timings include the tracing overhead unless trace_memory is off.
+    Returns: Benchmark report
+    """
+    generator = DataGenerator(source)
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip() or None,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__,
+            'n_iter': n_iter,
+            'trace_memory': trace_memory,
+        },
+        'results': [],
+    }
+
+    print(f"\nEnd-to-end benchmark ({n_sites or len(generator.sites)} sites, "
+          f"{n_periods or len(generator.periods)} periods, days: {days})")
+    print(f"  {'rows':>10} | {'step':>8} | {'time':>10} | {'peak memory':>11}")
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for n_days in days:
+                filepath = os.path.join(tmp_dir, f"sites_{n_days}.csv")
+                df = generator.write_csv(filepath, n_sites, n_periods, n_days)
+                scale = {'sites': int(df['site'].nunique()), 'periods': int(df['period_of_day'].nunique()),
+                         'days': n_days, 'rows': len(df)}
+                del df
+                plot_dir = os.path.join(tmp_dir, f"plots_{n_days}") if plot else None
+                report['results'] += benchmark_scale(filepath, scale, plot_dir, n_iter, trace_memory)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    directory = os.path.dirname(output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"  -> Results written to {output}")
+    return report
+
+
+async def http_request(reader:asyncio.StreamReader, writer:asyncio.StreamWriter, method:str, path:str,
+                       body:bytes=b"") -> tuple:
+    """
+    Sends one keep-alive HTTP/1.1 request on an open connection and reads the response.
+    Returns: Status code, response body
+    """
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    start_line, _, response = await read_http_message(reader)
+    return int(start_line.split(" ")[1]), response
+
+
+async def load_test(port:int, bodies:list, concurrency:int) -> tuple:
+    """
+    Closed-loop load test: concurrency keep-alive connections each send the next request body as soon as
+    their previous request is answered, until all bodies are sent. Then reads the service batch counters.
+    Returns: Latencies (s), total time (s), number of failed requests, /health payload
+    """
+    requests = iter(bodies)
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for body in requests:
+            start = time.perf_counter()
+            status, _ = await http_request(reader, writer, "POST", "/predict", body)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    total = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    _, health = await http_request(reader, writer, "GET", "/health")
+    writer.close()
+    return np.array(latencies), total, errors, json.loads(health)
+
+
+def start_service(model_path:str, max_batch_size:int, max_wait_ms:float, timeout:float=60.0) -> tuple:
+    """
+    Starts the prediction service on a free port in a subprocess and waits until it accepts connections.
+    Returns: Service process, port
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    process = subprocess.Popen([sys.executable, "prediction_service.py", "--model", model_path, "--port", str(port),
+                                "--max-batch-size", str(max_batch_size), "--max-wait-ms", str(max_wait_ms)],
+                               stdout=subprocess.DEVNULL)
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The prediction service exited with code {process.returncode}.")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"The prediction service did not start within {timeout} s.")
+
+
+def report_service(filepath:str, model_path:str, n_requests:int, concurrency:int, batch_sizes:list,
+                   max_wait_ms:float):
+    """
+    Load test of the prediction service (one random shift per request), for several max batch sizes:
+    latency percentiles, throughput and the average number of rows scored per predict call.
+    """
+    if not os.path.exists(model_path):
+        load_or_train_model(filepath, model_path)
+    partitions = DataProcessor(filepath).partition_index('clean')
+    rng = np.random.default_rng(0)
+    bodies = [json.dumps({'site': site, 'period_of_day': period, 'sales': round(sales, 2)}).encode()
+              for site, period, sales in zip(rng.choice(partitions.sites, n_requests),
+                                             rng.choice(partitions.periods, n_requests),
+                                             rng.uniform(0, 500, n_requests).tolist())]
+
+    print(f"\nPrediction service load test ({n_requests:,} requests, {concurrency} connections, "
+          f"max wait {max_wait_ms:g} ms)")
+    print(f"  {'max batch':>9} | {'p50':>9} | {'p99':>9} | {'req/s':>8} | {'rows/batch':>10} | errors")
+    for max_batch_size in batch_sizes:
+        process, port = start_service(model_path, max_batch_size, max_wait_ms)
+        try:
+            latencies, total, errors, health = asyncio.run(load_test(port, bodies, concurrency))
+        finally:
+            process.terminate()
+            process.wait()
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+        print(f"  {max_batch_size:>9} | {p50:>6.2f} ms | {p99:>6.2f} ms | {n_requests / total:>8,.0f} | "
+              f"{health['rows'] / max(health['batches'], 1):>10.1f} | {errors}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Performance reports for the headcount model pipeline.")
+    subparsers = parser.add_subparsers(dest='report', required=True)
+
+    parser_prof = subparsers.add_parser('profitability', help="Profitability labelling and dtype memory report.")
+    parser_prof.add_argument('--filepath', default='sites_data.csv')
+    parser_prof.add_argument('--rows', type=int, default=10_000_000)
+    parser_prof.add_argument('--legacy-rows', type=int, default=100_000)
+    parser_prof.add_argument('--float-dtype', default='float32')
+
+    parser_inf = subparsers.add_parser('inference', help="Flat forest vs sklearn predict latency/throughput report.")
+    parser_inf.add_argument('--filepath', default='sites_data.csv')
+    parser_inf.add_argument('--model', default='models/rf_model.joblib')
+    parser_inf.add_argument('--rows', type=int, default=1_000_000)
+    parser_inf.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 100, 10_000, 1_000_000])
+
+    parser_lookup = subparsers.add_parser('lookup', help="Headcount lookup table resolution/throughput report.")
+    parser_lookup.add_argument('--filepath', default='sites_data.csv')
+    parser_lookup.add_argument('--model', default='models/rf_model.joblib')
+    parser_lookup.add_argument('--rows', type=int, default=1_000_000)
+    parser_lookup.add_argument('--steps', type=float, nargs='+', default=[10, 1, 0.5, 0.1, 0.01])
+
+    parser_imports = subparsers.add_parser('imports', help="Import time of the headless entry points.")
+    parser_imports.add_argument('--modules', nargs='+', default=HEADLESS_MODULES)
+    parser_imports.add_argument('--repeat', type=int, default=3)
+    parser_imports.add_argument('--max-seconds', type=float, default=3.0)
+
+    parser_service = subparsers.add_parser('service', help="Prediction service load test (latency/throughput).")
+    parser_service.add_argument('--filepath', default='sites_data.csv')
+    parser_service.add_argument('--model', default='models/rf_model.joblib',
+                                help="Model artifact, sharded model directory or lookup table (.npz).")
+    parser_service.add_argument('--requests', type=int, default=5000)
+    parser_service.add_argument('--concurrency', type=int, default=64)
+    parser_service.add_argument('--max-batch-sizes', type=int, nargs='+', default=[1, 16, 256])
+    parser_service.add_argument('--max-wait-ms', type=float, default=5.0)
+
+    parser_suite = subparsers.add_parser('suite', help="End-to-end pipeline benchmark on synthetic data, as JSON.")
+    parser_suite.add_argument('--source', default='sites_data.csv', help="CSV file the synthetic data is modelled on.")
+    parser_suite.add_argument('--days', type=int, nargs='+', default=[2000, 20000], help="Scales, in days of data.")
+    parser_suite.add_argument('--sites', type=int, default=None)
+    parser_suite.add_argument('--periods', type=int, default=None)
+    parser_suite.add_argument('--n-iter', type=int, default=5, help="Hyperparameter search candidates.")
+    parser_suite.add_argument('--no-plot', action='store_true', help="Don't benchmark the plots.")
+    parser_suite.add_argument('--no-memory', action='store_true', help="Don't trace memory (timings without overhead).")
+    parser_suite.add_argument('--output', default='benchmarks/results.json')
+
+    args = parser.parse_args()
+    if args.report == 'profitability':
+        report_profitability(args.filepath, args.rows, args.legacy_rows, args.float_dtype)
+    elif args.report == 'inference':
+        report_inference(args.filepath, args.model, args.rows, args.batch_sizes)
+    elif args.report == 'lookup':
+        report_lookup(args.filepath, args.model, args.rows, args.steps)
+    elif args.report == 'service':
+        report_service(args.filepath, args.model, args.requests, args.concurrency, args.max_batch_sizes,
+                       args.max_wait_ms)
+    elif args.report == 'suite':
+        report_suite(args.source, args.days, args.sites, args.periods, args.output, args.n_iter,
+                     not args.no_plot, not args.no_memory)
+    elif args.report == 'imports':
+        if not report_imports(args.modules, args.repeat, args.max_seconds):
+            sys.exit(1)
@@ -0,0 +1,90 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class DataGenerator:
+    """
+    Synthetic shift data, statistically similar to a source CSV (same layout as sites_data.csv).
+
+    For every (site, period_of_day) of the source, the generator keeps the observed headcount frequencies
+    and the mean and standard deviation of the sales of each headcount. A synthetic shift draws a headcount
+    from the frequencies of its group, then its sales from a normal distribution with the matching mean and
+    standard deviation, so the sales/headcount relationship the model learns is kept.
+
+    Sites and periods beyond those of the source reuse the source profiles in turn
+    (site5 behaves like site1, period4 like the first period, ...).
+    """
+    def __init__(self, filepath:str='sites_data.csv') -> None:
+        df = pd.read_csv(filepath, header=0, skip_blank_lines=True, skipinitialspace=True, index_col=0).dropna()
+        self.sites = sorted(df['site'].astype(str).unique())
+        self.periods = list(pd.unique(df['period_of_day'].astype(str)))
+        self.profiles = self.fit_profiles(df)
+
+    def fit_profiles(self, df:pd.DataFrame) -> dict:
+        """
+        Headcount frequencies and sales distribution per headcount, for every (site, period_of_day).
+        Returns: Dictionary of (site, period) to (headcounts, probabilities, sales means, sales stds)
+        """
+        profiles = {}
+        stats = df.groupby(['site', 'period_of_day', 'headcount'])['sales'].agg(['count', 'mean', 'std'])
+        for (site, period), group in stats.groupby(level=[0, 1]):
+            counts = group['count'].to_numpy(dtype=np.float64)
+            profiles[(site, period)] = (group.index.get_level_values('headcount').to_numpy(),
+                                        counts / counts.sum(),
+                                        group['mean'].to_numpy(),
+                                        group['std'].fillna(0).to_numpy())
+        return profiles
+
+    def generate(self, n_sites:int=None, n_periods:int=None, n_days:int=2000, seed:int=0) -> pd.DataFrame:
+        """
+        One shift per site, period of day and day (n_sites * n_periods * n_days rows),
+        ordered by site, period of day and day.
+        Returns: Pandas dataframe with the columns of the source CSV
+        """
+        n_sites = len(self.sites) if n_sites is None else n_sites
+        n_periods = len(self.periods) if n_periods is None else n_periods
+        rng = np.random.default_rng(seed)
+
+        frames = []
+        for i in range(n_sites):
+            for j in range(n_periods):
+                period = self.periods[j] if j < len(self.periods) else f"period{j + 1}"
+                headcounts, probabilities, means, stds = self.profiles[(self.sites[i % len(self.sites)],
+                                                                        self.periods[j % len(self.periods)])]
+                classes = rng.choice(len(headcounts), size=n_days, p=probabilities)
+                frames.append(pd.DataFrame({
+                    'site': f"site{i + 1}",
+                    'sales': rng.normal(means[classes], stds[classes]),
+                    'period_of_day': period,
+                    'headcount': headcounts[classes],
+                }))
+        return pd.concat(frames, ignore_index=True)
+
+    def write_csv(self, filepath:str, n_sites:int=None, n_periods:int=None, n_days:int=2000, seed:int=0) -> pd.DataFrame:
+        """
+        Generates data and writes it as a CSV that DataProcessor can read.
+        Returns: Generated dataframe
+        """
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        df = self.generate(n_sites, n_periods, n_days, seed)
+        df.to_csv(filepath)
+        return df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic shift data similar to sites_data.csv.")
+    parser.add_argument('output', help="Output CSV file.")
+    parser.add_argument('--source', default='sites_data.csv', help="CSV file the distributions are learned from.")
+    parser.add_argument('--sites', type=int, default=None, help="Number of sites (default: as in the source).")
+    parser.add_argument('--periods', type=int, default=None, help="Number of periods of day (default: as in the source).")
+    parser.add_argument('--days', type=int, default=2000, help="Number of days (one shift per site and period per day).")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = DataGenerator(args.source).write_csv(args.output, args.sites, args.periods, args.days, args.seed)
+    print(f"  -> Wrote {len(df):,} rows to {args.output}")
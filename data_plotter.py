@@ -1,33 +1,160 @@
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 import seaborn as sns
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import stage_profiler
+from partition_index import PartitionIndex
+
+# Plotter of each rendering worker process (set by init_render_worker)
+worker_plotter = None
+
+
+def init_render_worker(df:pd.DataFrame, output_dir:str, image_format:str, plotter_kwargs:dict) -> None:
+    """
+    Sets up a rendering worker: non-interactive backend and a plotter for the shared dataframe,
+    so the data is sent once per worker rather than once per figure.
+    """
+    global worker_plotter
+    matplotlib.use("Agg")
+    worker_plotter = DataPlotter(df, output_dir=output_dir, image_format=image_format, **plotter_kwargs)
+
+
+def render_plot(method:str, kwargs:dict) -> str:
+    """
+    Renders one figure in a worker process.
+    """
+    getattr(worker_plotter, method)(**kwargs)
+    return method
+
 
 class DataPlotter:
-    def __init__(self, df:pd.DataFrame) -> None:
+    """
+    Plots the data and saves the figures to output_dir as image_format (any format supported by matplotlib).
+    Each figure is closed once saved.
+
+    Aggregated rendering switches on above aggregate_threshold rows (None to never aggregate), so render
+    time and file size stay bounded: scatter plots draw one marker per cell of a sales_bins x headcount
+    density grid (sized by count), and violin plots are built from at most violin_sample rows per group.
+
+    Per-site and per-period subsets come from a (site, period_of_day) partition index of df,
+    e.g. DataProcessor.partition_index(), which is built here if not given.
+
+    With an active StageProfiler (see stage_profiler), plot_all, every figure and every figure save are
+    measured as plotter.<stage> (figures rendered by worker processes only count towards plotter.plot_all).
+    """
+    def __init__(self, df:pd.DataFrame, output_dir:str="plots", image_format:str="png",
+                 aggregate_threshold:int=200_000, sales_bins:int=100, violin_sample:int=10_000,
+                 partitions:PartitionIndex=None) -> None:
         self.df_training = df
+        self.partitions = PartitionIndex(df) if partitions is None else partitions
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.aggregate_threshold = aggregate_threshold
+        self.sales_bins = sales_bins
+        self.violin_sample = violin_sample
+        self.aggregate = aggregate_threshold is not None and len(df) > aggregate_threshold
+
+    def plotter_kwargs(self) -> dict:
+        """
+        Aggregation settings, to build an identical plotter in a worker process.
+        """
+        return {"aggregate_threshold": self.aggregate_threshold,
+                "sales_bins": self.sales_bins,
+                "violin_sample": self.violin_sample,
+                "partitions": self.partitions}
         
-    def plot_all(self):
+    def plot_tasks(self) -> list:
+        """
+        All relevant graphs, as (method name, keyword arguments).
+        """
+        return [
+            # Scatter plots
+            ("scatterplot_headcount_vs_sales_per_site", {}),
+            ("scatterplot_headcount_vs_sales_per_site_period", {"period_of_day": "morning"}),
+            ("scatterplot_headcount_vs_sales_per_site_period", {"period_of_day": "afternoon"}),
+            ("scatterplot_headcount_vs_sales_per_site_period", {"period_of_day": "evening"}),
+
+            # Box plots
+            ("boxplot_headcount_per_site_period", {}),
+            ("boxplot_sales_per_site_period_a", {}),
+            ("boxplot_sales_per_site_period_b", {}),
+
+            # Violin plots
+            ("violinplot_sales_per_site_period", {}),
+            ("violinplot_per_site_period", {"x": "site", "y": "avg_profit_per_headcount", "hue": "period_of_day"}),
+        ]
+
+    @stage_profiler.profiled('plotter.plot_all')
+    def plot_all(self, n_jobs:int=1):
         """
         Plots all relevant graphs.
+        With n_jobs > 1 (or None for all cores), the figures are rendered in parallel by a pool of
+        headless worker processes using the non-interactive Agg backend.
         """
-        # Scatter plots
-        self.scatterplot_headcount_vs_sales_per_site()
-        self.scatterplot_headcount_vs_sales_per_site_period("morning")
-        self.scatterplot_headcount_vs_sales_per_site_period("afternoon")
-        self.scatterplot_headcount_vs_sales_per_site_period("evening")
-        
-        # Box plots
-        self.boxplot_headcount_per_site_period()
-        self.boxplot_sales_per_site_period_a()
-        self.boxplot_sales_per_site_period_b()
+        tasks = self.plot_tasks()
+        if n_jobs == 1:
+            for method, kwargs in tasks:
+                with stage_profiler.stage(f"plotter.{method}", rows=len(self.df_training)):
+                    getattr(self, method)(**kwargs)
+            return
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_render_worker,
+                                 initargs=(self.df_training, self.output_dir, self.image_format,
+                                           self.plotter_kwargs())) as executor:
+            futures = [executor.submit(render_plot, method, kwargs) for method, kwargs in tasks]
+            for future in futures:
+                future.result()
+
+    @stage_profiler.profiled('plotter.save_figure')
+    def save_figure(self, fig, name:str, lgd) -> None:
+        """
+        Saves a figure to the output directory and closes it to release its memory.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        fig.savefig(fname=os.path.join(self.output_dir, f"{name}.{self.image_format}"),
+                    bbox_extra_artists=(lgd,), bbox_inches='tight')
+        plt.close(fig)
+
+    def scatter_sales_headcount(self, splot, df:pd.DataFrame, alpha:float, label:str) -> None:
+        """
+        Scatter of headcount vs sales. In aggregated mode, the rows are binned into a density grid
+        (sales bins x headcount values) and each non-empty cell is drawn once, sized by its count.
+        """
+        if not self.aggregate:
+            splot.scatter(df['sales'], df['headcount'], 
+                        s = 200, alpha=alpha, edgecolors = 'black', label=label)
+            return
 
-        # Violin plots
-        self.violinplot_sales_per_site_period()
-        self.violinplot_per_site_period(x="site", y="avg_profit_per_headcount", hue="period_of_day")
+        sales = self.df_training['sales']
+        headcount = self.df_training['headcount']
+        sales_edges = np.linspace(sales.min(), sales.max(), self.sales_bins + 1)
+        headcount_edges = np.arange(headcount.min() - 0.5, headcount.max() + 1.5)
+        counts, _, _ = np.histogram2d(df['sales'], df['headcount'], bins=[sales_edges, headcount_edges])
+
+        sales_index, headcount_index = np.nonzero(counts)
+        sales_centres = (sales_edges[:-1] + sales_edges[1:]) / 2
+        headcount_centres = (headcount_edges[:-1] + headcount_edges[1:]) / 2
+        cell_counts = counts[sales_index, headcount_index]
+        splot.scatter(sales_centres[sales_index], headcount_centres[headcount_index],
+                      s = 200 * np.sqrt(cell_counts / counts.max()) if len(cell_counts) else 200,
+                      alpha=min(1.0, alpha * 2), edgecolors = 'black', label=label)
+
+    def violin_data(self, df:pd.DataFrame, by:list) -> pd.DataFrame:
+        """
+        Data for the violin plots. In aggregated mode, a random sample of at most violin_sample rows
+        per group, so the KDEs don't run over the full frame.
+        """
+        if not self.aggregate:
+            return df
+
+        df_shuffled = df.iloc[np.random.default_rng(0).permutation(len(df))]
+        keep = df_shuffled.groupby(by, observed=True).cumcount() < self.violin_sample
+        return df_shuffled[keep.to_numpy()]
 
     def scatterplot_headcount_vs_sales_per_site(self):
         """
@@ -35,12 +162,7 @@ class DataPlotter:
         Grouped by site.
         """
         df = self.df_training
-        
-        df_site_1 = df[df["site"] == 'site1']
-        df_site_2 = df[df["site"] == 'site2']
-        df_site_3 = df[df["site"] == 'site3']
-        df_site_4 = df[df["site"] == 'site4']
-        df_sites = [df_site_1, df_site_2, df_site_3, df_site_4]
+        df_sites = [self.partitions.take(df, site=site) for site in self.partitions.sites]
         
         # Plots
         fig = plt.figure()
@@ -48,8 +170,7 @@ class DataPlotter:
         site_counter = 1
         
         for site in df_sites:
-            splot.scatter(site['sales'], site['headcount'], 
-                        s = 200, alpha=0.2, edgecolors = 'black', label=f'Site {site_counter}')
+            self.scatter_sales_headcount(splot, site, alpha=0.2, label=f'Site {site_counter}')
             site_counter += 1
         
         plt.yticks(np.arange(min(df['headcount']), max(df['headcount'])+1, 1.0))
@@ -59,29 +180,19 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname="plots/scatterplot_headcount_vs_sales_per_site", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, "scatterplot_headcount_vs_sales_per_site", lgd)
         
     def scatterplot_headcount_vs_sales_per_site_period(self, period_of_day:str):
         df = self.df_training
-        try:
-            df_site_1 = df[(df["site"] == 'site1') & (df["period_of_day"] == period_of_day)]
-            df_site_2 = df[(df["site"] == 'site2') & (df["period_of_day"] == period_of_day)]
-            df_site_3 = df[(df["site"] == 'site3') & (df["period_of_day"] == period_of_day)]
-            df_site_4 = df[(df["site"] == 'site4') & (df["period_of_day"] == period_of_day)]
-            df_sites = [df_site_1, df_site_2, df_site_3, df_site_4]
-        except KeyError:
-            raise KeyError("Cannot find specified period of day in the database.")
+        df_sites = [self.partitions.take(df, site=site, period_of_day=period_of_day) for site in self.partitions.sites]
         
         # Plots
         site_counter = 1
         fig = plt.figure()
         splot = fig.add_subplot(111)
         for site in df_sites:
+            self.scatter_sales_headcount(splot, site, alpha=0.1, label=f'Site {site_counter}')
             site_counter += 1
-            splot.scatter(site['sales'], site['headcount'], 
-                        s = 200, alpha=0.1, edgecolors = 'black', label=f'Site {site_counter}')
         
         plt.yticks(np.arange(min(df['headcount']), max(df['headcount'])+1, 1.0))
         plt.title(f'Headcount vs sales\n({period_of_day})', loc='center')
@@ -90,9 +201,7 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname=f"plots/scatterplot_headcount_vs_sales_per_site_{period_of_day}", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, f"scatterplot_headcount_vs_sales_per_site_{period_of_day}", lgd)
         
     def boxplot_headcount_per_site_period(self):
         """
@@ -120,9 +229,7 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
 
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname="plots/boxplot_headcount_per_site_period", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, "boxplot_headcount_per_site_period", lgd)
         
     
     def boxplot_sales_per_site_period_a(self):
@@ -150,9 +257,7 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname="plots/boxplot_sales_per_site_period_a", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, "boxplot_sales_per_site_period_a", lgd)
     
     def boxplot_sales_per_site_period_b(self):
         """
@@ -179,12 +284,10 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname="plots/boxplot_sales_per_site_period_b", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, "boxplot_sales_per_site_period_b", lgd)
        
     def violinplot_sales_per_site_period(self):
-        df = self.df_training
+        df = self.violin_data(self.df_training, by=["site", "period_of_day"])
 
         fig = plt.figure()
         sns.violinplot(x="site", y="sales", hue="period_of_day", data=df, palette="rocket")
@@ -195,12 +298,10 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname="plots/violinplot_sales_per_site_period", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, "violinplot_sales_per_site_period", lgd)
     
     def violinplot_per_site_period(self, x:str, y:str, hue:str):
-        df = self.df_training
+        df = self.violin_data(self.df_training, by=[x, hue])
 
         fig = plt.figure()
         sns.violinplot(x=x, y=y, hue=hue, data=df, palette="rocket")
@@ -211,7 +312,5 @@ class DataPlotter:
         lgd = plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Save plot
-        if not os.path.exists("plots"):
-            os.makedirs("plots")
-        plt.savefig(fname=f"plots/violinplot_{y}_per_{x}_{hue}", bbox_extra_artists=(lgd,), bbox_inches='tight')
+        self.save_figure(fig, f"violinplot_{y}_per_{x}_{hue}", lgd)
     
\ No newline at end of file
@@ -1,94 +1,453 @@
+import glob
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+import stage_profiler
+from dataset_cache import DatasetCache
+from partition_index import PartitionIndex
+from summary_sketch import SummarySketch
+
+# Default profit assumptions
+TAX_RATE = 0.2
+HOURLY_WAGE = 11.95                     # London living wage 2022-2023 (GBP)
+OPTIMAL_PROFIT_PER_HEADCOUNT = 40       # GBP/staff
+
+# Profitability classes, ordered from worst to best
+PROFITABILITY_LABELS = ["negative", "sub-optimal", "optimal"]
+
+# Columns of the cleaned data
+CLEAN_COLUMNS = ["site", "sales", "period_of_day", "headcount"]
+
+# Columns summarised when streaming the data in chunks
+SUMMARY_COLUMNS = ["sales", "total_profit", "avg_profit_per_headcount"]
+
+
+def strip_header(df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Strips the spaces around the column names, the same way whichever CSV parser read the header.
+    Returns: The dataframe itself
+    """
+    df.columns = df.columns.str.strip()
+    return df
+
+
+def read_source(filepath:str, stage:str, processor_kwargs:dict) -> pd.DataFrame:
+    """
+    Reads one file of a multi-file source in a worker: the raw or clean stage of a single-file DataProcessor.
+    """
+    return DataProcessor(filepath, **processor_kwargs).stage(stage)
+
+
+def concat_frames(frames:list) -> pd.DataFrame:
+    """
+    Concatenates frames in a single pass. Categorical columns are first recoded to the union of their
+    categories (a cheap remap of the codes), so they stay categorical instead of falling back to objects.
+    The input list is emptied so the per-file frames can be released.
+    """
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+            categories = sorted(set().union(*(frame[column].cat.categories for frame in frames)))
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    df = pd.concat(frames, ignore_index=True)
+    frames.clear()
+    return df
+
+
 class DataProcessor():
     """
-    Loads and cleans data from the relevant .csv file.
+    Loads and cleans data from the relevant .csv file, or from all the .csv files of a directory or glob pattern
+    (e.g. one export per site and month). Multiple files must have the same columns: they are read and cleaned
+    concurrently by n_jobs worker processes (None for all cores) and concatenated once.
+    engine: pandas CSV parser ('c' by default, 'pyarrow' for pyarrow's multithreaded parser, in which case the
+    files are read by threads, and fields must not start with spaces). pyarrow can't read in chunks, so streaming
+    (chunksize) always uses the C parser.
+    Money columns are stored as float_dtype (e.g. 'float32' to halve their memory footprint).
+    Profit assumptions (tax_rate, hourly_wage, optimal_profit_per_headcount) default to the module constants;
+    to compare many of them at once without re-running the pipeline, see ScenarioEngine.
+
+    The pipeline stages (raw -> clean -> extended -> optimal_prof, plus summary) are computed lazily on
+    first access of the matching df_* attribute, memoized, and can be dropped with release().
+    Stages never modify their input: a derived stage shares the unchanged columns of the stage it comes
+    from and only allocates the columns it adds, so treat the frames as read-only (copy before editing).
+
+    Streaming mode (chunksize set): the file is processed chunk by chunk when the processor is created.
+    Only per (site, period_of_day) aggregates are kept in memory (df_summary), and the extended and
+    optimal rows are appended to CSV files in output_dir if given. The full-size stages are not built
+    unless they are accessed.
+
+    Cached mode (cache_dir set): the extended frame is stored in a columnar on-disk cache keyed by the
+    source file fingerprint ('hash' or 'mtime') and the profit parameters, and memory-mapped on later runs.
+
+    Each stage build is measured as processor.<stage> when a StageProfiler is active (see stage_profiler).
     """
-    def __init__(self, filepath:str) -> None:
-        self.df_training_raw = self.load_csv(filepath)
-        self.df_training_clean = self.clean_df()
-        self.df_training_extended = self.calculate_profit_per_headcount()
-        self.df_training_optimal_prof = self.return_df_optimal_profitability()
+    def __init__(self, filepath:str, float_dtype:str='float64', chunksize:int=None, output_dir:str=None,
+                 cache_dir:str=None, cache_fingerprint:str='hash', tax_rate:float=TAX_RATE,
+                 hourly_wage:float=HOURLY_WAGE, optimal_profit_per_headcount:float=OPTIMAL_PROFIT_PER_HEADCOUNT,
+                 engine:str=None, n_jobs:int=None) -> None:
+        self.filepath = filepath
+        self.sources = self.resolve_sources(filepath)
+        self.engine = engine
+        self.n_jobs = n_jobs
+        self.float_dtype = np.dtype(float_dtype)
+        self.tax_rate = tax_rate
+        self.hourly_wage = hourly_wage
+        self.optimal_profit_per_headcount = optimal_profit_per_headcount
+        self.cache = DatasetCache(cache_dir, cache_fingerprint) if cache_dir is not None else None
+        self.stages = {}
+
+        if chunksize is not None:
+            self.stages['summary'] = self.stream_csv(filepath, chunksize, output_dir)
+
+    # ----- Lazy pipeline stages -----
+    @property
+    def df_training_raw(self) -> pd.DataFrame:
+        return self.stage('raw')
+
+    @property
+    def df_training_clean(self) -> pd.DataFrame:
+        return self.stage('clean')
+
+    @property
+    def df_training_extended(self) -> pd.DataFrame:
+        return self.stage('extended')
+
+    @property
+    def df_training_optimal_prof(self) -> pd.DataFrame:
+        return self.stage('optimal_prof')
+
+    @property
+    def df_summary(self) -> pd.DataFrame:
+        return self.stage('summary')
+
+    @property
+    def summary_sketch(self) -> SummarySketch:
+        return self.stage('sketch')
+
+    def stage(self, name:str):
+        """
+        Returns the output of a pipeline stage, building it (and the stages it depends on) on first access.
+        """
+        if name not in self.stages:
+            builders = {
+                'cached': self.build_cached,
+                'raw': lambda: self.load_csv(self.filepath) if len(self.sources) == 1 else self.load_sources('raw'),
+                'clean': self.build_clean,
+                'extended': self.build_extended,
+                'optimal_prof': lambda: self.return_df_optimal_profitability(self.df_training_extended),
+                'summary': lambda: self.summary_table(self.summary_sketch),
+                'sketch': lambda: self.new_summary_sketch().update(self.df_training_extended),
+            }
+            if name not in builders:
+                raise KeyError(f"Unknown pipeline stage {name}")
+            with stage_profiler.stage(f"processor.{name}") as record:
+                self.stages[name] = builders[name]()
+                # The summaries have one row per group: their rows processed are the rows summarised
+                record['rows'] = (self.summary_sketch.n_rows if name in ('summary', 'sketch')
+                                  else stage_profiler.n_rows(self.stages[name]))
+        return self.stages[name]
+
+    def release(self, *names:str) -> None:
+        """
+        Drops memoized stages (all of them if no name is given) so their memory can be reclaimed.
+        Released stages are rebuilt on next access.
+        """
+        for name in (names or list(self.stages)):
+            self.stages.pop(name, None)
+
+    def build_cached(self):
+        """
+        Extended frame from the on-disk cache, or None if caching is off or there is no valid entry.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.load(self.filepath, self.profit_params(), sources=self.cache_sources())
+
+    def build_clean(self) -> pd.DataFrame:
+        """
+        Clean stage: the clean columns of the cached extended frame (no copy), the files of a multi-file source
+        cleaned in parallel, or clean_df of the raw stage.
+        """
+        df_cached = self.stage('cached')
+        if df_cached is not None:
+            return pd.DataFrame({column: df_cached[column] for column in CLEAN_COLUMNS}, copy=False)
+        if len(self.sources) > 1:
+            return self.load_sources('clean')
+        return self.clean_df(self.df_training_raw)
+
+    def build_extended(self) -> pd.DataFrame:
+        """
+        Extended stage: the cached extended frame, or calculate_profit_per_headcount of the clean stage.
+        """
+        df_cached = self.stage('cached')
+        if df_cached is not None:
+            return df_cached
+
+        df_extended = self.calculate_profit_per_headcount(self.df_training_clean)
+        if self.cache is not None:
+            self.cache.save(self.filepath, self.profit_params(), df_extended, sources=self.cache_sources())
+        return df_extended
+
+    def profit_params(self) -> dict:
+        """
+        Parameters that the processed data depends on (used as part of the cache key).
+        """
+        return {'tax_rate': self.tax_rate,
+                'hourly_wage': self.hourly_wage,
+                'optimal_profit_per_headcount': self.optimal_profit_per_headcount,
+                'float_dtype': self.float_dtype.name}
     
-    def load_csv(self, filepath:str):
+    def cache_sources(self) -> list:
+        """
+        Files the cache entry is fingerprinted on: None for a single file (fingerprinted directly).
+        """
+        return self.sources if len(self.sources) > 1 else None
+
+    def resolve_sources(self, filepath:str) -> list:
+        """
+        Files to read: filepath itself if it is a file (even if its name has glob characters),
+        the .csv files of a directory, or the files matching a glob pattern.
+        Returns: Sorted list of file paths
+        """
+        if os.path.isfile(filepath):
+            return [filepath]
+        if os.path.isdir(filepath):
+            sources = sorted(glob.glob(os.path.join(filepath, "*.csv")))
+        elif any(character in filepath for character in "*?["):
+            sources = sorted(glob.glob(filepath))
+        else:
+            return [filepath]
+        if not sources:
+            raise FileNotFoundError(f"Couldn't find any data file in {filepath}")
+        return sources
+
+    def validate_sources(self, sources:list=None) -> list:
+        """
+        Checks that all the files of a multi-file source (self.sources by default) have the same columns,
+        including CLEAN_COLUMNS, from their headers only (see strip_header).
+        Returns: Columns of the files
         """
-        Load the CSV data into a Pandas dataframe.
-        Returns: Pandas dataframe
+        sources = self.sources if sources is None else sources
+        schemas = {source: strip_header(pd.read_csv(source, nrows=0)).columns.tolist() for source in sources}
+        expected = schemas[sources[0]]
+        missing = [column for column in CLEAN_COLUMNS if column not in expected]
+        if missing:
+            raise ValueError(f"{sources[0]} is missing the columns {missing}.")
+        mismatched = [source for source, columns in schemas.items() if columns != expected]
+        if mismatched:
+            raise ValueError(f"{len(mismatched)} files have other columns than {sources[0]} ({expected}), "
+                             f"e.g. {mismatched[0]}: {schemas[mismatched[0]]}.")
+        return expected
+
+    def load_sources(self, stage:str) -> pd.DataFrame:
+        """
+        Raw or clean stage of a multi-file source: the files are validated, read (and cleaned) concurrently,
+        then concatenated once.
+        Returns: Pandas dataframe (with a new range index)
         """
+        self.validate_sources()
+        processor_kwargs = {'float_dtype': self.float_dtype.name, 'engine': self.engine}
+        if self.n_jobs == 1:
+            return concat_frames([read_source(source, stage, processor_kwargs) for source in self.sources])
+
+        # pyarrow parses in native threads without the GIL, the C parser needs processes to run in parallel
+        executor_class = ThreadPoolExecutor if self.engine == 'pyarrow' else ProcessPoolExecutor
+        with executor_class(max_workers=self.n_jobs) as executor:
+            frames = list(executor.map(read_source, self.sources, itertools.repeat(stage),
+                                       itertools.repeat(processor_kwargs)))
+        return concat_frames(frames)
+
+    def load_csv(self, filepath:str, chunksize:int=None):
+        """
+        Load the CSV data into a Pandas dataframe, with the spaces around the column names stripped.
+        Returns: Pandas dataframe, or an iterator of dataframes with at most chunksize rows
+        """
+        # The pyarrow parser supports neither chunksize nor skipinitialspace
+        engine = 'c' if chunksize is not None and self.engine == 'pyarrow' else self.engine
+        options = {'engine': engine} if engine == 'pyarrow' else {'engine': engine, 'skipinitialspace': True}
         try:
-            df = pd.read_csv(filepath, header=0, skip_blank_lines=True, skipinitialspace=True).dropna(how='all')
+            if chunksize is not None:
+                reader = pd.read_csv(filepath, header=0, skip_blank_lines=True, chunksize=chunksize, **options)
+                return (strip_header(chunk.dropna(how='all')) for chunk in reader)
+            df = strip_header(pd.read_csv(filepath, header=0, skip_blank_lines=True, **options).dropna(how='all'))
             return df
         
         except KeyError:
             raise KeyError(f"Couldn't find data file {filepath}")
     
-    def clean_df(self):
+    def clean_df(self, df:pd.DataFrame=None):
         """
-        Cleans the data from the CSV.
+        Cleans the data from the CSV (df_training_raw unless another frame is given).
         Returns: Cleaned Pandas dataframe
         """
-        df = self.df_training_raw
+        if df is None:
+            df = self.df_training_raw
         
         # Delete first column (i.e. counter)
-        df.drop(df.columns[0], axis=1, inplace= True)
+        df = df.drop(df.columns[0], axis=1)
         
-        # Cast column data types
-        df['site'] = df['site'].astype(str)
-        df['sales'] = df['sales'].round(decimals=2)
-        df['period_of_day'] = df['period_of_day'].astype(str)
-        df['headcount'] = df['headcount'].astype(int)
+        # Cast column data types (categoricals and small integers keep the memory footprint low)
+        df['site'] = df['site'].astype(str).astype('category')
+        df['sales'] = df['sales'].round(decimals=2).astype(self.float_dtype)
+        df['period_of_day'] = df['period_of_day'].astype(str).astype('category')
+        df['headcount'] = pd.to_numeric(df['headcount'].astype(int), downcast='integer')
 
         return df
     
-    def calculate_profit_per_headcount(self):
+    def calculate_profit_per_headcount(self, df:pd.DataFrame=None):
         """
         Calculates the average profit per staff member. 
         Profit is simplified as sales minus tax and salaries.
         
-        Assumptions: 
-        - Tax rate is 20%
-        - Salary is £11.95 per staff member (London living wage 2022-2023).
+        Assumptions (defaults): 
+        - Tax rate is 20% (tax_rate)
+        - Salary is £11.95 per staff member (hourly_wage, London living wage 2022-2023).
         """
-        df_extended = self.df_training_clean
+        df_extended = (self.df_training_clean if df is None else df).copy(deep=False)
         
         # Calculate taxes and costs
-        df_extended["sales_taxes"] = df_extended["sales"] * 0.2
-        df_extended["labour_costs"] = df_extended["headcount"] * 11.95
+        df_extended["sales_taxes"] = df_extended["sales"] * self.float_dtype.type(self.tax_rate)
+        df_extended["labour_costs"] = (df_extended["headcount"] * self.hourly_wage).astype(self.float_dtype)
         
         # Calculate profits
         df_extended["total_profit"] = df_extended["sales"] - (df_extended["sales_taxes"] + df_extended["labour_costs"])
         df_extended["avg_profit_per_headcount"] = df_extended["total_profit"] / df_extended["headcount"]
         
         # Calculate profitability
-        df_extended["profitability"] = df_extended.apply(self.check_profitability, axis=1)
+        df_extended["profitability"] = self.label_profitability(df_extended["avg_profit_per_headcount"])
            
         return df_extended
     
     def check_profitability(self, row):
         """
         Filter method for pandas dataframe.
-        Checks for profitability: negative (<=0), sub-optimal (1-59) or optimal (>=60).
+        Checks for profitability: negative (<=0), sub-optimal (0-40) or optimal (>=40),
+        with the 40 GBP/staff default of optimal_profit_per_headcount.
         """
         if row['avg_profit_per_headcount'] <= 0:
             prof = "negative"
-        elif 0 < row['avg_profit_per_headcount'] < 40:
+        elif 0 < row['avg_profit_per_headcount'] < self.optimal_profit_per_headcount:
             prof = "sub-optimal"
         else:
             prof = "optimal"
         return prof
+
+    def label_profitability(self, avg_profit_per_headcount:pd.Series) -> pd.Series:
+        """
+        Vectorized version of check_profitability for a whole column.
+        Returns: Categorical series with the same labels as check_profitability.
+        """
+        values = avg_profit_per_headcount.to_numpy()
+        codes = np.select([values <= 0, values < self.optimal_profit_per_headcount], [0, 1], default=2).astype(np.int8)
+        labels = pd.Categorical.from_codes(codes, categories=PROFITABILITY_LABELS)
+        return pd.Series(labels, index=avg_profit_per_headcount.index, name="profitability")
     
-    def return_df_optimal_profitability(self):
+    def return_df_optimal_profitability(self, df:pd.DataFrame=None):
         """
         Returned filtered dataframe with only rows with optimal profitability.
         """
-        df = self.df_training_extended
+        if df is None:
+            df = self.df_training_extended
         df_optimal_prof = df.loc[df['profitability'] == 'optimal']
         return df_optimal_prof
 
+    def stream_csv(self, filepath:str, chunksize:int, output_dir:str=None) -> pd.DataFrame:
+        """
+        Runs each chunk of the CSV (of each file in turn, for a multi-file source) through clean -> extend -> optimal filter.
+        Peak memory depends on chunksize rather than on the file size.
+        If output_dir is given, the extended and optimal rows are appended to
+        extended.csv and optimal.csv as each chunk is processed.
+        Each chunk is added to the summary sketch stage (see describe_columns), which the summary is built from.
+        Returns: Summary dataframe per site and period of day (see summary_table)
+        """
+        with stage_profiler.stage('processor.stream') as record:
+            if output_dir is not None and not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            sketch = self.new_summary_sketch()
+            first_chunk = True
+            n_rows = 0
+            sources = self.resolve_sources(filepath)
+            if len(sources) > 1:
+                self.validate_sources(sources)
+            chunks = itertools.chain.from_iterable(self.load_csv(source, chunksize=chunksize) for source in sources)
+            for chunk in chunks:
+                df_extended = self.calculate_profit_per_headcount(self.clean_df(chunk))
+                df_optimal_prof = self.return_df_optimal_profitability(df_extended)
+
+                if output_dir is not None:
+                    mode = 'w' if first_chunk else 'a'
+                    df_extended.to_csv(os.path.join(output_dir, "extended.csv"), mode=mode, header=first_chunk, index=False)
+                    df_optimal_prof.to_csv(os.path.join(output_dir, "optimal.csv"), mode=mode, header=first_chunk, index=False)
+
+                sketch.update(df_extended)
+                first_chunk = False
+                n_rows += len(chunk)
 
-    def describe_df_column(self, column:str):
+            self.stages['sketch'] = sketch
+            record['rows'] = n_rows
+            return self.summary_table(sketch)
+
+    def new_summary_sketch(self) -> SummarySketch:
+        """
+        Empty mergeable summary of extended rows: SUMMARY_COLUMNS statistics and profitability counts
+        per site and period of day.
         """
-        Describe specific dataframe column.
+        return SummarySketch(SUMMARY_COLUMNS, counts={'profitability': PROFITABILITY_LABELS})
+
+    def summary_table(self, sketch:SummarySketch) -> pd.DataFrame:
         """
-        print(f"\nTable description for {column}")
-        print(self.df_training_extended.groupby(['site','period_of_day'])[column].describe())
+        count, mean, std (ddof=1), min and max of SUMMARY_COLUMNS plus the profitability counts,
+        per site and period of day, from a summary sketch (see new_summary_sketch).
+        Returns: Pandas dataframe indexed by (site, period_of_day)
+        """
+        df_summary = sketch.result()
+        columns = [(column, statistic) for column in SUMMARY_COLUMNS for statistic in ('count', 'mean', 'std', 'min', 'max')]
+        df_summary = df_summary[columns + [('profitability', label) for label in PROFITABILITY_LABELS]].copy()
+        for column in SUMMARY_COLUMNS:
+            df_summary[(column, 'count')] = df_summary[(column, 'count')].astype(np.int64)
+        return df_summary
+
+
+    def partition_index(self, stage:str='extended') -> PartitionIndex:
+        """
+        (site, period_of_day) partition index of a stage ('clean', 'extended' or 'optimal_prof'),
+        built once and shared by the describe path, the plotter and the model.
+        """
+        name = f"partitions_{stage}"
+        if name not in self.stages:
+            df = self.stage(stage)
+            with stage_profiler.stage('processor.partition_index', rows=len(df)):
+                self.stages[name] = PartitionIndex(df)
+        return self.stages[name]
+
+    def describe_df_column(self, column:str) -> pd.DataFrame:
+        """
+        Describe specific dataframe column, per site and period of day, with exact quantiles
+        (one pass over the rows per column; see describe_columns for several columns at once).
+        Returns: Description table
+        """
+        partitions = self.partition_index()
+        with stage_profiler.stage('processor.describe', rows=partitions.n_rows):
+            return partitions.describe(self.df_training_extended, column)
+
+    def describe_columns(self, columns:list=None) -> pd.DataFrame:
+        """
+        count, mean, std, min, approximate quartiles and max of several columns, per site and period of day,
+        from the summary sketch: one pass over the rows for all the columns (chunk by chunk in streaming mode).
+        Quantiles are within 1% of a value of the data at that rank; the other statistics are exact.
+        Sketches of other chunks or files can be merged in beforehand (self.summary_sketch.merge(...)).
+        Returns: Pandas dataframe indexed by (site, period_of_day), with (column, statistic) columns
+        """
+        columns = SUMMARY_COLUMNS if columns is None else list(columns)
+        if set(columns) <= set(SUMMARY_COLUMNS):
+            sketch = self.summary_sketch
+        else:
+            with stage_profiler.stage('processor.sketch', rows=len(self.df_training_extended)):
+                sketch = SummarySketch(columns).update(self.df_training_extended)
+        with stage_profiler.stage('processor.describe', rows=sketch.n_rows):
+            return sketch.result()[columns]
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Bump when the on-disk layout or the processing logic changes, so old entries are ignored
+CACHE_VERSION = 1
+
+
+def file_fingerprint(filepath:str, mode:str='hash') -> str:
+    """
+    Fingerprint of a file: content hash ('hash'), or size and modification time ('mtime').
+    """
+    if mode == 'mtime':
+        stat = os.stat(filepath)
+        return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def save_frame(directory:str, df:pd.DataFrame, meta:dict=None) -> None:
+    """
+    Writes a dataframe as one .npy file per column (categoricals as codes) plus a meta.json
+    with the column dtypes, categories and any extra meta entries.
+    The directory is written next to its final location and renamed into place, so readers
+    never see a partial frame.
+    """
+    tmp_dir = directory + ".tmp"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        series = df[name]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), series.cat.codes.to_numpy())
+            categories = series.cat.categories.tolist()
+        else:
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), series.to_numpy())
+            categories = None
+        columns.append({'name': name, 'categories': categories})
+
+    # Only store the index if it is not the default range
+    index = None
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        np.save(os.path.join(tmp_dir, "index.npy"), df.index.to_numpy())
+        index = "index.npy"
+
+    with open(os.path.join(tmp_dir, "meta.json"), 'w') as f:
+        json.dump({**(meta or {}), 'columns': columns, 'index': index}, f)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_dir, directory)
+
+
+def load_frame(directory:str, mmap:bool=True) -> pd.DataFrame:
+    """
+    Reads a dataframe written by save_frame.
+    With mmap, numeric columns are memory-mapped copy-on-write, so edits never reach the files.
+    """
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+
+    mmap_mode = 'c' if mmap else None
+    columns = {}
+    for i, column in enumerate(meta['columns']):
+        # Plain ndarray view over the mapping (no copy)
+        values = np.load(os.path.join(directory, f"{i}.npy"), mmap_mode=mmap_mode).view(np.ndarray)
+        if column['categories'] is not None:
+            values = pd.Categorical.from_codes(values, categories=column['categories'])
+        columns[column['name']] = pd.Series(values, copy=False)
+
+    df = pd.DataFrame(columns, copy=False)
+    df.index = pd.RangeIndex(len(df)) if meta['index'] is None else np.load(os.path.join(directory, "index.npy"))
+    return df
+
+
+
+class DatasetCache:
+    """
+    On-disk columnar cache of processed dataframes.
+    Each entry is a directory with one .npy file per column (categoricals are stored as codes)
+    and a meta.json with the column dtypes and categories, so columns can be memory-mapped on load.
+    Entries are keyed by the fingerprint of the source file plus the processing parameters.
+    A source made of several files (a directory or glob filepath) passes them as sources: the entry is then
+    keyed by the fingerprints of all of them.
+    """
+    def __init__(self, cache_dir:str, fingerprint:str='hash') -> None:
+        if fingerprint not in ('hash', 'mtime'):
+            raise ValueError(f"Unknown fingerprint mode {fingerprint}, use 'hash' or 'mtime'.")
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+
+    def source_fingerprint(self, filepath:str, sources:list=None) -> str:
+        """
+        Fingerprint of the source file (see file_fingerprint), or of the files it is made of.
+        """
+        if sources is None:
+            return file_fingerprint(filepath, self.fingerprint)
+        return json.dumps([[os.path.abspath(source), file_fingerprint(source, self.fingerprint)] for source in sources])
+
+    def key(self, filepath:str, params:dict, sources:list=None) -> str:
+        """
+        Cache key for a source file and the parameters used to process it.
+        """
+        payload = json.dumps({'version': CACHE_VERSION,
+                              'source': self.source_fingerprint(filepath, sources),
+                              'params': params}, sort_keys=True)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def load(self, filepath:str, params:dict, mmap:bool=True, sources:list=None) -> pd.DataFrame:
+        """
+        Load the cached dataframe for a source file and parameters.
+        With mmap, numeric columns are memory-mapped copy-on-write, so edits never reach the cache.
+        Returns: Pandas dataframe, or None if there is no valid entry
+        """
+        entry_dir = os.path.join(self.cache_dir, self.key(filepath, params, sources))
+        meta_path = os.path.join(entry_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        return load_frame(entry_dir, mmap)
+
+    def save(self, filepath:str, params:dict, df:pd.DataFrame, sources:list=None) -> None:
+        """
+        Store a dataframe for a source file and parameters.
+        Stale entries for the same source file and parameters are removed.
+        """
+        key = self.key(filepath, params, sources)
+        save_frame(os.path.join(self.cache_dir, key), df, {'source': os.path.abspath(filepath), 'params': params})
+        self.prune(filepath, params, keep=key)
+
+    def prune(self, filepath:str, params:dict, keep:str) -> None:
+        """
+        Remove cache entries for filepath and params other than keep (i.e. built from an older version of the file).
+        """
+        source = os.path.abspath(filepath)
+        for entry in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.cache_dir, entry, "meta.json")
+            if entry == keep or not os.path.exists(meta_path):
+                continue
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if meta.get('source') == source and meta.get('params') == params:
+                shutil.rmtree(os.path.join(self.cache_dir, entry))
@@ -0,0 +1,177 @@
+import numpy as np
+
+from sklearn.ensemble import RandomForestClassifier
+
+from model_optimal_headcount import broadcast_inputs
+
+
+class FlatForest:
+    """
+    Random forest compiled into flat NumPy node arrays for high-throughput scoring.
+    The nodes of all trees are concatenated into one set of arrays (feature, threshold, children,
+    leaf class probabilities), and all trees are traversed at once over a batch, one tree level per step,
+    advancing only the (tree, row) pairs that have not reached a leaf yet.
+
+    With few features (site, sales, period of day), the forest is also compiled into a cell table:
+    the thresholds of each feature cut its axis into intervals, and every row of the same cell
+    (interval of every feature) goes down the same path in every tree. Each cell is scored once, and a batch
+    is scored with one searchsorted per feature and a table lookup. The table is only built if it has
+    at most max_cells cells; otherwise rows are scored by traversal.
+    Predictions are identical to the source forest's predict().
+    """
+    def __init__(self, forest:RandomForestClassifier, batch_size:int=4096, max_cells:int=1_000_000) -> None:
+        self.classes = forest.classes_
+        self.n_features = forest.n_features_in_
+        self.batch_size = batch_size
+        self.headcount_model = None
+        self.compile(forest)
+        self.compile_cells(max_cells)
+
+    @classmethod
+    def from_model(cls, headcount_model, batch_size:int=4096, max_cells:int=1_000_000) -> "FlatForest":
+        """
+        Compiles the best estimator of a ModelOptimalHeadcount (trained or loaded),
+        keeping its category encodings for predict_headcount().
+        """
+        flat_forest = cls(headcount_model.model, batch_size=batch_size, max_cells=max_cells)
+        flat_forest.headcount_model = headcount_model
+        return flat_forest
+
+    def compile(self, forest:RandomForestClassifier) -> None:
+        """
+        Flattens the trees of the forest into concatenated node arrays.
+        """
+        features, thresholds, lefts, rights, leaves, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            leaves.append(is_leaf)
+
+            # Class probabilities of each node, normalised as in DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :len(self.classes)].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        self.roots = np.array(roots, dtype=np.intp)
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts).astype(np.intp)
+        self.right = np.concatenate(rights).astype(np.intp)
+        self.is_leaf = np.concatenate(leaves)
+        self.value = np.concatenate(values)
+        self.max_depth = max_depth
+
+    def compile_cells(self, max_cells:int) -> None:
+        """
+        Builds the cell table (class probabilities and predicted class of every cell), if it has at most max_cells cells.
+        Trees compare float32 features to float64 thresholds: for a float32 x, x <= threshold is the same as
+        x <= the largest float32 not above threshold, so the cell bounds are those float32 values.
+        """
+        self.bounds = []
+        for feature in range(self.n_features):
+            thresholds = self.threshold[(self.feature == feature) & ~self.is_leaf]
+            bounds = thresholds.astype(np.float32)
+            above = bounds > thresholds
+            bounds[above] = np.nextafter(bounds[above], np.float32(-np.inf))
+            self.bounds.append(np.unique(bounds))
+
+        self.cell_shape = tuple(len(bounds) + 1 for bounds in self.bounds)
+        if np.prod(self.cell_shape, dtype=np.float64) > max_cells:
+            self.cell_proba = self.cell_class = None
+            return
+
+        # One point per cell: the upper bound of its interval on every feature (just above the last bound for the last)
+        points = [np.append(bounds, np.nextafter(bounds[-1] if len(bounds) else np.float32(0), np.float32(np.inf)))
+                  for bounds in self.bounds]
+        grid = np.stack([axis.ravel() for axis in np.meshgrid(*points, indexing='ij')], axis=1)
+        # Score the cells by traversal
+        self.cell_proba = None
+        self.cell_proba = self.predict_proba(grid)
+        self.cell_class = np.argmax(self.cell_proba, axis=1)
+
+    def cells(self, X:np.ndarray) -> np.ndarray:
+        """
+        Cell of every row of X (flat index into the cell table).
+        Returns: Numpy array of cell indices
+        """
+        X = np.asarray(X, dtype=np.float32)
+        return np.ravel_multi_index([np.searchsorted(bounds, X[:, feature], side='left')
+                                     for feature, bounds in enumerate(self.bounds)], self.cell_shape)
+
+    def apply(self, X:np.ndarray) -> np.ndarray:
+        """
+        Finds the leaf reached in every tree for every row of X.
+        Returns: Numpy array of global node indices, shape (n_trees, n_rows)
+        """
+        # Trees compare float32 features, as sklearn does
+        X = np.asarray(X, dtype=np.float32).ravel()
+        n_rows = X.shape[0] // self.n_features
+        nodes = np.repeat(self.roots, n_rows)
+        offsets = np.tile(np.arange(n_rows) * self.n_features, len(self.roots))
+        # (tree, row) pairs still in an internal node
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            current = nodes[active]
+            go_left = X[offsets[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+        return nodes.reshape(len(self.roots), n_rows)
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Class probabilities averaged over the trees, from the cell table or else by traversal
+        in batches of batch_size rows.
+        Returns: Numpy array, shape (n_rows, n_classes)
+        """
+        X = np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}.")
+        if self.cell_proba is not None:
+            return self.cell_proba[self.cells(X)]
+
+        proba = np.zeros((X.shape[0], len(self.classes)))
+        for start in range(0, X.shape[0], self.batch_size):
+            leaves = self.apply(X[start:start + self.batch_size])
+            batch_proba = proba[start:start + self.batch_size]
+            # Sum the trees in order, like the source forest
+            for tree_leaves in leaves:
+                batch_proba += self.value[tree_leaves]
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Predicted class for every row of X.
+        Returns: Numpy array
+        """
+        if self.cell_class is not None:
+            X = np.asarray(X)
+            if X.ndim != 2 or X.shape[1] != self.n_features:
+                raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}.")
+            return self.classes.take(self.cell_class[self.cells(X)], axis=0)
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+    def predict_headcount(self, sites, periods, sales) -> np.ndarray:
+        """
+        Same as ModelOptimalHeadcount.predict_headcount, scored with the flat forest.
+        Returns: Numpy array of headcounts, with the broadcast shape of the inputs
+        """
+        if self.headcount_model is None:
+            raise ValueError("No category encodings, build the flat forest with FlatForest.from_model().")
+        sites, periods, sales, shape = broadcast_inputs(sites, periods, sales)
+        X = self.headcount_model.features(sites, periods, sales)
+        return self.predict(X.to_numpy(dtype=np.float64)).reshape(shape)
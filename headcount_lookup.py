@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from model_optimal_headcount import broadcast_inputs
+
+
+class HeadcountLookup:
+    """
+    Precomputed headcount table for O(1) serving.
+    The model is evaluated once at the centre of every sales bin for every (site, period) pair,
+    and queries are answered by binning sales, without touching the forest.
+    Sales outside [sales_min, sales_max) fall into the first or last bin.
+    """
+    def __init__(self, headcount_model, sales_min:float=0.0, sales_max:float=600.0, step:float=0.5) -> None:
+        self.sites = list(headcount_model.site_to_num)
+        self.periods = list(headcount_model.period_of_day_to_num)
+        self.sales_min = sales_min
+        self.step = step
+        self.n_bins = int(np.ceil((sales_max - sales_min) / step))
+        self.sales_max = sales_min + self.n_bins * step
+        self.table, self.classes = self.precompute(headcount_model)
+
+    def precompute(self, headcount_model) -> tuple:
+        """
+        Evaluates the model over the sales grid for every (site, period) pair in one batch.
+        Returns: Table of class indices with shape (n_sites, n_periods, n_bins), classes
+        """
+        bin_centres = self.sales_min + (np.arange(self.n_bins) + 0.5) * self.step
+
+        grid_sites, grid_periods, grid_sales = np.meshgrid(np.array(self.sites, dtype=object),
+                                                           np.array(self.periods, dtype=object),
+                                                           bin_centres, indexing='ij')
+        headcounts = headcount_model.predict_headcount(grid_sites.ravel(), grid_periods.ravel(), grid_sales.ravel())
+
+        # Store class indices in the smallest integer type
+        classes, codes = np.unique(headcounts, return_inverse=True)
+        table = codes.astype(np.min_scalar_type(len(classes))).reshape(len(self.sites), len(self.periods), self.n_bins)
+        return table, classes
+
+    def index_of(self, values, keys:list, name:str) -> np.ndarray:
+        """
+        Positions of categorical values along a table axis.
+        """
+        values = np.asarray(values, dtype=object).ravel()
+        index = pd.Series(values).map({key: i for i, key in enumerate(keys)})
+        missing = index.isna().to_numpy()
+        if missing.any():
+            raise ValueError(f"Unknown {name} {sorted(set(values[missing]))}, the table covers {keys}.")
+        return index.to_numpy(dtype=np.intp)
+
+    def sales_bin(self, sales) -> np.ndarray:
+        """
+        Bin of each sales value (clipped to the grid).
+        """
+        bins = np.floor((np.asarray(sales, dtype=np.float64).ravel() - self.sales_min) / self.step)
+        return np.clip(bins, 0, self.n_bins - 1).astype(np.intp)
+
+    def predict_headcount(self, sites, periods, sales) -> np.ndarray:
+        """
+        Looks up the headcount for a batch of planned shifts (same arguments as ModelOptimalHeadcount.predict_headcount).
+        Returns: Numpy array of headcounts, with the broadcast shape of the inputs
+        """
+        sites, periods, sales, shape = broadcast_inputs(sites, periods, sales)
+        site_index = self.index_of(sites, self.sites, 'site')
+        period_index = self.index_of(periods, self.periods, 'period of day')
+        return self.classes[self.table[site_index, period_index, self.sales_bin(sales)]].reshape(shape)
+
+    def disagreement(self, headcount_model, n_samples:int=100_000, seed:int=0) -> pd.DataFrame:
+        """
+        How often the table disagrees with the model, on sales drawn uniformly over the grid
+        for every (site, period) pair.
+        Returns: Disagreement rate per site and period of day
+        """
+        rng = np.random.default_rng(seed)
+        rates = {}
+        for site in self.sites:
+            for period in self.periods:
+                sales = rng.uniform(self.sales_min, self.sales_max, n_samples)
+                expected = headcount_model.predict_headcount(site, period, sales)
+                rates[(site, period)] = float(np.mean(self.predict_headcount(site, period, sales) != expected))
+
+        df_rates = pd.Series(rates, name='disagreement').to_frame()
+        df_rates.index.names = ['site', 'period_of_day']
+        return df_rates
+
+    def save(self, filepath:str) -> None:
+        """
+        Saves the table and its grid as a .npz file.
+        """
+        np.savez(filepath, table=self.table, classes=self.classes,
+                 grid=np.array([self.sales_min, self.step, self.n_bins], dtype=np.float64),
+                 sites=np.array(self.sites), periods=np.array(self.periods))
+
+    @classmethod
+    def load(cls, filepath:str) -> "HeadcountLookup":
+        """
+        Loads a table saved with save().
+        """
+        with np.load(filepath) as data:
+            lookup = cls.__new__(cls)
+            lookup.table = data['table']
+            lookup.classes = data['classes']
+            lookup.sales_min, lookup.step, n_bins = data['grid'].tolist()
+            lookup.n_bins = int(n_bins)
+            lookup.sales_max = lookup.sales_min + lookup.n_bins * lookup.step
+            lookup.sites = data['sites'].tolist()
+            lookup.periods = data['periods'].tolist()
+        return lookup
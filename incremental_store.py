@@ -0,0 +1,117 @@
+import json
+import os
+
+import pandas as pd
+
+from data_processor import PROFITABILITY_LABELS, DataProcessor
+from dataset_cache import file_fingerprint, load_frame, save_frame
+
+# Bump when the on-disk layout of the store changes
+STORE_VERSION = 1
+
+
+class IncrementalStore:
+    """
+    Append-only store of processed (extended) shifts, partitioned by site.
+    Each daily batch file is processed on its own with DataProcessor and written as one new
+    columnar frame per site it touches (site_<i>/batch_<n>), so ingesting a day costs the size
+    of that day, not of the history. Existing partitions are never rewritten.
+
+    A manifest.json records the profit parameters of the store, the site partitions and the
+    ingested batches (with their content fingerprint, so a file is never ingested twice).
+    processor_kwargs are passed to DataProcessor (e.g. float_dtype, tax_rate) and must stay
+    the same for the lifetime of the store.
+    """
+    def __init__(self, store_dir:str, **processor_kwargs) -> None:
+        self.store_dir = store_dir
+        self.processor_kwargs = processor_kwargs
+        self.manifest_path = os.path.join(store_dir, "manifest.json")
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('store_version') != STORE_VERSION:
+                raise ValueError(f"Store {store_dir} has version {self.manifest.get('store_version')}, "
+                                 f"expected {STORE_VERSION}.")
+        else:
+            self.manifest = {'store_version': STORE_VERSION, 'params': None, 'partitions': {}, 'batches': []}
+
+    @property
+    def sites(self) -> list:
+        return sorted(self.manifest['partitions'])
+
+    @property
+    def batches(self) -> list:
+        return self.manifest['batches']
+
+    def ingest(self, filepath:str) -> pd.DataFrame:
+        """
+        Processes a new batch file and appends its rows to the site partitions.
+        Returns: Extended dataframe of the new rows (the delta), or None if the file was already ingested
+        """
+        fingerprint = file_fingerprint(filepath)
+        if any(batch['fingerprint'] == fingerprint for batch in self.batches):
+            return None
+
+        data_processor = DataProcessor(filepath, **self.processor_kwargs)
+        params = data_processor.profit_params()
+        if self.manifest['params'] is None:
+            self.manifest['params'] = params
+        elif self.manifest['params'] != params:
+            raise ValueError(f"Batch {filepath} was processed with {params}, "
+                             f"the store was built with {self.manifest['params']}.")
+
+        df_delta = data_processor.df_training_extended
+        batch_id = len(self.batches)
+        partitions = data_processor.partition_index('extended')
+        rows = {}
+        for site in partitions.sites:
+            partition = self.manifest['partitions'].setdefault(site, f"site_{len(self.manifest['partitions'])}")
+            df_site = partitions.take(df_delta, site=site).reset_index(drop=True)
+            save_frame(os.path.join(self.store_dir, partition, f"batch_{batch_id}"), df_site)
+            rows[site] = len(df_site)
+
+        self.batches.append({'id': batch_id, 'source': os.path.abspath(filepath),
+                             'fingerprint': fingerprint, 'rows': rows})
+        self.save_manifest()
+        return df_delta
+
+    def save_manifest(self) -> None:
+        """
+        Writes the manifest atomically, after the partitions it lists.
+        """
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def load(self, sites:list=None, batches:list=None, optimal_only:bool=False) -> pd.DataFrame:
+        """
+        Reads back the stored rows, optionally only for some sites and/or batch ids,
+        and only the optimal profitability rows (the model training data).
+        Returns: Extended dataframe (site, period_of_day and profitability as categoricals)
+        """
+        sites = self.sites if sites is None else sites
+        frames = []
+        for batch in self.batches:
+            if batches is not None and batch['id'] not in batches:
+                continue
+            for site in sites:
+                if site not in batch['rows']:
+                    continue
+                df_site = load_frame(os.path.join(self.store_dir, self.manifest['partitions'][site],
+                                                  f"batch_{batch['id']}"))
+                if optimal_only:
+                    df_site = df_site.loc[df_site['profitability'] == 'optimal']
+                frames.append(df_site)
+
+        if not frames:
+            raise ValueError(f"No stored rows for sites {sites} and batches {batches}.")
+
+        # Each frame has its own categories, so they are unified after the concat
+        df = pd.concat(frames, ignore_index=True)
+        for column in ['site', 'period_of_day']:
+            df[column] = df[column].astype(str).astype('category')
+        df['profitability'] = pd.Categorical(df['profitability'].astype(str), categories=PROFITABILITY_LABELS)
+        return df
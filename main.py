@@ -1,11 +1,76 @@
+import argparse
+import atexit
+import os
+import sys
+
 from data_processor import DataProcessor
-from data_plotter import DataPlotter
 from model_optimal_headcount import ModelOptimalHeadcount
+import stage_profiler
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Optimal headcount model.")
+    parser.add_argument('--data', default='sites_data.csv',
+                        help="Data CSV file, or directory / glob pattern of CSV files with the same columns.")
+    parser.add_argument('--plot', action='store_true', help="Plot all graphs (loads the plotting libraries).")
+    parser.add_argument('--plot-dir', default='plots', help="Output directory of the plots.")
+    parser.add_argument('--plot-format', default='png', help="Image format of the plots.")
+    parser.add_argument('--plot-jobs', type=int, default=None, help="Plot rendering processes (default: all cores).")
+    parser.add_argument('--headless', action='store_true', help="Don't show the feature importance chart.")
+    parser.add_argument('--sharded', action='store_true', help="Also train one model per site, in parallel.")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed of the model search and training.")
+    parser.add_argument('--no-cache', action='store_true', help="Don't reuse cached data or training runs.")
+    parser.add_argument('--ingest', nargs='+', metavar='CSV',
+                        help="Append daily batch files to the incremental store, update its sharded model and exit.")
+    parser.add_argument('--store-dir', default='store', help="Directory of the incremental store.")
+    parser.add_argument('--profile', metavar='TRACE',
+                        help="Write a JSON trace with the wall time, CPU time, rows and peak RSS of every pipeline stage.")
+    parser.add_argument('--profile-stage', metavar='STAGE',
+                        help="Also run a stage under cProfile (e.g. model.search), stats written to profiles/.")
+    args = parser.parse_args()
+
+    if args.profile or args.profile_stage:
+        profiler = stage_profiler.StageProfiler(cprofile_stage=args.profile_stage)
+        stage_profiler.activate(profiler)
+        atexit.register(profiler.report, args.profile, {'argv': sys.argv[1:]})
+
+    if args.ingest:
+        from incremental_store import IncrementalStore
+        from sharded_model import ShardedHeadcountModel
+
+        # ----- Incremental mode - Append the new batches and update the model from them -----
+        # The model lives in the store, so it is always trained on the data the store holds
+        store = IncrementalStore(args.store_dir)
+        model_dir = os.path.join(args.store_dir, 'model')
+        sharded_model = (ShardedHeadcountModel.load(model_dir)
+                         if os.path.exists(os.path.join(model_dir, 'manifest.json')) else None)
+
+        for filepath in args.ingest:
+            df_delta = store.ingest(filepath)
+            if df_delta is None:
+                print(f"  -> {filepath} was already ingested, skipped.")
+                continue
+            df_delta_optimal = df_delta.loc[df_delta['profitability'] == 'optimal']
+            print(f"  -> {filepath}: {len(df_delta)} new rows, {len(df_delta_optimal)} with optimal profitability.")
+
+            if sharded_model is None:
+                sharded_model = ShardedHeadcountModel(store.load(optimal_only=True), random_state=args.seed,
+                                                      cache_dir=None if args.no_cache else os.path.join('.cache', 'training'))
+                print(f"  -> Trained {len(sharded_model.shards)} shards: {', '.join(sharded_model.shards)}")
+            else:
+                updated = sharded_model.update(df_delta_optimal,
+                                               history=lambda sites: store.load(sites, optimal_only=True))
+                print("  -> Updated shards: " + ', '.join(f"{shard} ({how})" for shard, how in updated.items()))
+            sharded_model.save(model_dir)
+        sys.exit(0)
+
+    if args.plot:
+        # Only load the plotting stack when it is needed
+        from data_plotter import DataPlotter
+
     # ----- Setup - Load and clean data -----
-    data_processor = DataProcessor('sites_data.csv')
+    data_processor = DataProcessor(args.data, cache_dir=None if args.no_cache else '.cache')
 
     # ----- Explore the data - Plots -----
     # Describe and plot all values
@@ -13,26 +78,43 @@ if __name__ == '__main__':
     data = data_processor.df_training_extended
     print("\nAll data")
     print(data.head(100))
-    
-    data_processor.describe_df_column("sales")
-    data_processor.describe_df_column("total_profit")
-    data_processor.describe_df_column("avg_profit_per_headcount")
 
-    plotter = DataPlotter(data)
-    #plotter.plot_all()
+    df_describe = data_processor.describe_columns(["sales", "total_profit", "avg_profit_per_headcount"])
+    for column in df_describe.columns.unique(level=0):
+        print(f"\nTable description for {column}")
+        print(df_describe[column])
+
+    if args.plot:
+        plotter = DataPlotter(data, output_dir=os.path.join(args.plot_dir, "all_profitabilities"),
+                              image_format=args.plot_format, partitions=data_processor.partition_index('extended'))
+        plotter.plot_all(n_jobs=args.plot_jobs)
 
     # Plot only values with optimal profitability
     print("\n----- Extended Data - Optimal Profitabilities -----")
     data_optimal_prof = data_processor.df_training_optimal_prof
-    
+
     print("Optimal profit data")
     print(data_optimal_prof.head(100))
     print(f"  -> {data_optimal_prof.shape[0]} passed the 40 GBP/staff criteria for optimal headcount.")
-    
-    plotter_prof = DataPlotter(data_optimal_prof)
-    #plotter_prof.plot_all()
-    
+
+    if args.plot:
+        plotter_prof = DataPlotter(data_optimal_prof, output_dir=os.path.join(args.plot_dir, "only_optimal_profitability (more than 40)"),
+                                   image_format=args.plot_format, partitions=data_processor.partition_index('optimal_prof'))
+        plotter_prof.plot_all(n_jobs=args.plot_jobs)
+
     # ----- Model -----
     print("\n----- Model -----")
-    rf_model = ModelOptimalHeadcount(data_optimal_prof, print_tree=False, show_cm=False, show_pred=True)
-    
\ No newline at end of file
+    rf_model = ModelOptimalHeadcount(data_optimal_prof, print_tree=False, show_cm=False, show_pred=not args.headless,
+                                     partitions=data_processor.partition_index('optimal_prof'), random_state=args.seed,
+                                     cache_dir=None if args.no_cache else os.path.join('.cache', 'training'))
+    rf_model.save('models/rf_model.joblib')
+
+    if args.sharded:
+        from sharded_model import ShardedHeadcountModel
+
+        print("\n----- Sharded model (one per site) -----")
+        sharded_model = ShardedHeadcountModel(data_optimal_prof, partitions=data_processor.partition_index('optimal_prof'),
+                                              random_state=args.seed,
+                                              cache_dir=None if args.no_cache else os.path.join('.cache', 'training'))
+        print(f"  -> Trained {len(sharded_model.shards)} shards: {', '.join(sharded_model.shards)}")
+        sharded_model.save('models/sharded')
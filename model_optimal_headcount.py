@@ -1,72 +1,162 @@
 # Data Processing
+import os
+import time
+
 import pandas as pd
 import numpy as np
 
-import matplotlib.pyplot as plt
-import seaborn as sns
-
+import joblib
+import sklearn
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.tree import DecisionTreeClassifier
 from sklearn.metrics import accuracy_score, confusion_matrix, precision_score, recall_score, ConfusionMatrixDisplay, classification_report
-from sklearn.model_selection import RandomizedSearchCV, train_test_split
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingRandomSearchCV)
+from sklearn.model_selection import (GridSearchCV, HalvingRandomSearchCV, ParameterSampler, RandomizedSearchCV,
+                                     train_test_split)
 from scipy.stats import randint
 
-from sklearn.tree import export_graphviz, plot_tree
-from IPython.display import Image, display
-import graphviz
-import pydot
+import stage_profiler
+from training_cache import TrainingCache, candidate_key, describe_param_dist, fingerprint_frames
+
+# Plotting, tree export and notebook display (matplotlib, graphviz, IPython) are imported
+# where they are used, so headless training and prediction don't load them.
+
+# Bump when the content of the saved model artifact changes
+ARTIFACT_VERSION = 1
+
+# Chronological order of the periods of day, used to number them in the category encodings
+PERIODS_OF_DAY = ['morning', 'afternoon', 'evening']
+
+# Default hyperparameter search space for the random forest
+PARAM_DIST = {'n_estimators': randint(1, 100),
+              'max_depth': randint(1, 20)}
+
+# Fraction of the candidates kept at each rung of the successive halving search (HalvingRandomSearchCV default)
+HALVING_FACTOR = 3
+
+
+def halving_candidate_fits(n_candidates:int, factor:int=HALVING_FACTOR) -> int:
+    """
+    Candidate evaluations of a successive halving search over all its rungs, at most
+    (as many rungs as needed to get down to one candidate, each keeping ceil(n / factor) of the previous).
+    Returns: Number of candidate evaluations (times cv for the number of fits)
+    """
+    total = 0
+    n_rungs = 1
+    while factor ** n_rungs <= n_candidates:
+        n_rungs += 1
+    for _ in range(n_rungs):
+        total += n_candidates
+        n_candidates = -(-n_candidates // factor)
+    return total
+
+
+def broadcast_inputs(sites, periods, sales) -> tuple:
+    """
+    Broadcasts the sites, periods of day and sales of a batch of planned shifts against each other
+    (array-likes of the same shape, or scalars).
+    Returns: Flat numpy arrays of sites, periods of day (objects) and sales (floats), broadcast shape
+    """
+    sites, periods, sales = np.broadcast_arrays(np.asarray(sites, dtype=object),
+                                                np.asarray(periods, dtype=object),
+                                                np.asarray(sales, dtype=np.float64))
+    return sites.ravel(), periods.ravel(), sales.ravel(), sales.shape
+
 
 class ModelOptimalHeadcount:
-    def __init__(self, df:pd.DataFrame, print_tree=False, show_cm=False, show_pred=False) -> None:
+    """
+    Random forest model for the optimal headcount.
+
+    Hyperparameter search:
+    - search: 'random' (RandomizedSearchCV) or 'halving' (successive halving, HalvingRandomSearchCV).
+    - n_iter candidates are evaluated per search round, with cv folds each.
+    - time_budget (seconds) and/or max_fits keep running search rounds until the budget is used up.
+      With neither, a single round is run. The time budget is a soft limit: a first round of one candidate measures
+      the wall time of a fit, and later rounds are cut down to the fits the remaining time affords at the slowest
+      rate seen so far,
+      so the search (with its refit) can still overrun it, by up to the probe round or about one fit.
+    - n_jobs cores are used for the CV folds and for building the trees of the final model.
+
+    The site and period of day encodings are learned from df (see learn_encodings) and saved with the model.
+    partitions: optional (site, period_of_day) PartitionIndex of df (see DataProcessor.partition_index),
+    used to encode the categorical features one group at a time.
+    verbose: print the search and performance results.
+
+    Training cache (cache_dir set, and a random_state so runs are reproducible): a run with the same training data,
+    features, search settings and seeds loads the fitted model, CV results and classification report instead of
+    training, and random searches reuse the CV scores of candidates already evaluated on the same training split
+    (only the new candidates count towards max_fits). See TrainingCache.
+
+    Training, its hyperparameter search, refit and evaluation, and predictions are measured as model.<stage>
+    when a StageProfiler is active (see stage_profiler).
+
+    A trained model can be saved with save() and restored with ModelOptimalHeadcount.load()
+    (without retraining), then queried in batches with predict_headcount(), and extended with
+    trees trained on new data with update().
+    """
+    def __init__(self, df:pd.DataFrame, print_tree=False, show_cm=False, show_pred=False,
+                 search:str='random', param_dist:dict=None, n_iter:int=5, cv:int=5,
+                 time_budget:float=None, max_fits:int=None, n_jobs:int=-1, random_state:int=None,
+                 partitions=None, verbose:bool=True, cache_dir:str=None) -> None:
+        if search not in ('random', 'halving'):
+            raise ValueError(f"Unknown search {search}, use 'random' or 'halving'.")
         self.df_training = df
-        self.model = self.rf_model(print_tree, show_cm, show_pred)
+        self.partitions = partitions
+        self.search = search
+        self.param_dist = PARAM_DIST if param_dist is None else param_dist
+        self.n_iter = n_iter
+        self.cv = cv
+        self.time_budget = time_budget
+        self.max_fits = max_fits
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+        self.training_cache = TrainingCache(cache_dir) if cache_dir is not None and random_state is not None else None
+        self.site_to_num, self.period_of_day_to_num = self.learn_encodings(df)
+        with stage_profiler.stage('model.train', rows=len(df)):
+            self.model = self.rf_model(print_tree, show_cm, show_pred)
         
-    def rf_model(self, print_tree, show_confusion_matrix, show_predictors) -> int:
+    def rf_model(self, print_tree, show_confusion_matrix, show_predictors) -> RandomForestClassifier:
         """
-        Using: Random Forest Regressor model.
-        Returns optimal headcount number for a specified site and period of the day.
+        Using: Random Forest Classifier model.
+        Predicts the optimal headcount number for a specified site and period of the day.
+        Returns: Best fitted model
         """
         df = self.df_training
         
-        # Convert categorical data to integers
-        site_to_num = {
-            'site1':1,
-            'site2':2,
-            'site3':3,
-            'site4':4
-        }
-        num_to_site = {
-            1:'site1',
-            2:'site2',
-            3:'site3',
-            4:'site4'
-        }
-        df['site'] = df['site'].map(site_to_num)
-
-        period_of_day_to_num = {
-            'morning':1,
-            'afternoon':2,
-            'evening':3
-        }
-        num_to_period_of_day = {
-            1:'morning',
-            2:'afternoon',
-            3:'evening'
-        }
-        df['period_of_day'] = df['period_of_day'].map(period_of_day_to_num)
+        # Convert categorical data to integers (on a new frame, the training data is left untouched)
+        with stage_profiler.stage('model.encode', rows=len(df)):
+            df = df.assign(**self.encode_training_categories(df))
 
         # Features (X) and target variable (y)
         X = df.drop(['headcount', 'sales_taxes', 'labour_costs', 'total_profit', 'avg_profit_per_headcount', 'profitability'], axis=1)     # Features
         y = df['headcount']
+        self.feature_names = list(X.columns)
 
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+        # ----- Training cache -----
+        run_key = self.run_key(X, y) if self.training_cache is not None else None
+        cached_run = self.training_cache.load_run(run_key) if run_key is not None else None
               
-        # ----- Fit model -----
-        rf = RandomForestClassifier()
-        rf.fit(X_train, y_train)
+        # ----- Hyperparameter tuning -----
+        if cached_run is not None:
+            best_rf, best_params = cached_run['model'], cached_run['best_params']
+            self.search_results, self.n_fits, self.search_time = (cached_run['search_results'], cached_run['n_fits'],
+                                                                  cached_run['search_time'])
+        else:
+            best_rf, best_params = self.search_hyperparameters(X_train, y_train)
+        if self.verbose:
+            print('\n  -> Best hyperparameters:',  best_params)
+            print(f"  -> Search: {self.n_fits} fits in {self.search_time:.1f} s" + (" (cached)" if cached_run else ""))
     
         if print_tree:
-                for i in range(4):
-                    tree = rf.estimators_[i]
+                import graphviz
+                from IPython.display import display
+                from sklearn.tree import export_graphviz
+
+                for i in range(min(4, len(best_rf.estimators_))):
+                    tree = best_rf.estimators_[i]
                     dot_data = export_graphviz(tree,
                                             feature_names=X_train.columns,  
                                             filled=True,  
@@ -78,39 +168,36 @@ class ModelOptimalHeadcount:
                     display(graph)
                 
         # ----- Prediction -----
-        y_pred = rf.predict(X_test)
+        with stage_profiler.stage('model.evaluate', rows=len(X_test)):
+            y_pred = best_rf.predict(X_test)     # Generate predictions with the best model
         accuracy = accuracy_score(y_test, y_pred)
-        print("\n  -> Accuracy:", accuracy)
-        
-        # ----- Hyperparameter tuning -----
-        # Use random search to find the best hyperparameters
-        param_dist = {'n_estimators': randint(1,100),
-              'max_depth': randint(1,20)}
-                
-        rand_search = RandomizedSearchCV(rf, 
-                                        param_distributions = param_dist, 
-                                        n_iter=5, 
-                                        cv=5)
-
-        rand_search.fit(X_train, y_train)        
-        best_rf = rand_search.best_estimator_
-
-        print('\n  -> Best hyperparameters:',  rand_search.best_params_)
+        if self.verbose:
+            print("\n  -> Accuracy:", accuracy)
         
         # ----- Confusion Matrix -----   
-        y_pred = best_rf.predict(X_test)     # Generate predictions with the best model
-                     
         if show_confusion_matrix:
+            import matplotlib.pyplot as plt
+
             fig = plt.figure()
             cm = ConfusionMatrixDisplay.from_predictions(y_test, y_pred)        
             plt.show()
 
         # ----- Performance Metrics -----
-        print("\n  -> Performance results")
-        print(classification_report(y_test, y_pred))
+        report = cached_run['report'] if cached_run is not None else classification_report(y_test, y_pred)
+        if self.verbose:
+            print("\n  -> Performance results")
+            print(report)
+
+        if run_key is not None and cached_run is None:
+            self.training_cache.save_run(run_key, {'model': best_rf, 'best_params': best_params,
+                                                   'search_results': self.search_results, 'n_fits': self.n_fits,
+                                                   'search_time': self.search_time, 'accuracy': accuracy,
+                                                   'report': report})
         
         # ----- Predictors -----
         if show_predictors:
+            import matplotlib.pyplot as plt
+
             # Create a series containing feature importances from the model and feature names from the training data
             feature_importances = pd.Series(best_rf.feature_importances_, index=X_train.columns).sort_values(ascending=False)
 
@@ -119,3 +206,321 @@ class ModelOptimalHeadcount:
             feature_importances.plot.bar()
             plt.xticks(rotation=0)
             plt.show()
+
+        return best_rf
+
+    @stage_profiler.profiled('model.search')
+    def search_hyperparameters(self, X_train:pd.DataFrame, y_train:pd.Series):
+        """
+        Searches the hyperparameters of the random forest in rounds of n_iter candidates,
+        until the time or fit budget is used up (see class docstring).
+        The CV folds run in parallel (n_jobs) with single-threaded forests, and only the best
+        candidate is refitted, with its trees built in parallel.
+        Results of every candidate are kept in self.search_results.
+        Returns: Best fitted model, best hyperparameters
+        """
+        start = time.perf_counter()
+        results = []
+        self.n_fits = 0
+        search_round = 0
+        if self.training_cache is not None:
+            scores_key = self.training_cache.key({'data': fingerprint_frames(X_train, y_train), 'cv': self.cv,
+                                                  'sklearn': sklearn.__version__})
+
+        # Slowest wall time per fit of the rounds so far, to size the rounds to the remaining time
+        # (candidates differ a lot in cost, so a cheap round must not make the next one too big)
+        fit_seconds = None
+
+        while True:
+            n_iter = self.n_iter
+            if self.max_fits is not None:
+                n_iter = self.cap_candidates(n_iter, self.max_fits - self.n_fits)
+            if self.time_budget is not None and fit_seconds is None:
+                # Probe round: one candidate, to measure the time of a fit
+                n_iter = min(n_iter, 1)
+            elif self.time_budget is not None:
+                # Keep one fit's worth of time for the refit of the best candidate
+                remaining = self.time_budget - (time.perf_counter() - start)
+                n_iter = self.cap_candidates(n_iter, int(remaining / fit_seconds) - 1)
+            if n_iter < 1:
+                break
+
+            # Different seed per round so rounds draw different candidates
+            seed = None if self.random_state is None else self.random_state + search_round
+            rf = RandomForestClassifier(n_jobs=1, random_state=seed)
+            round_start = time.perf_counter()
+            if self.search == 'halving':
+                search = HalvingRandomSearchCV(rf, param_distributions=self.param_dist, n_candidates=n_iter,
+                                               factor=HALVING_FACTOR, cv=self.cv, refit=False, n_jobs=self.n_jobs, random_state=seed)
+                search.fit(X_train, y_train)
+                round_results = pd.DataFrame(search.cv_results_)
+                # Only the candidates that survived to the last iteration were scored on all the resources
+                round_results = round_results[round_results['iter'] == round_results['iter'].max()]
+                round_fits = len(search.cv_results_['params']) * self.cv
+            elif self.training_cache is not None:
+                round_results, round_fits = self.search_cached_candidates(rf, X_train, y_train, n_iter, seed, scores_key)
+            else:
+                search = RandomizedSearchCV(rf, param_distributions=self.param_dist, n_iter=n_iter,
+                                            cv=self.cv, refit=False, n_jobs=self.n_jobs, random_state=seed)
+                search.fit(X_train, y_train)
+                round_results = pd.DataFrame(search.cv_results_)
+                round_fits = len(search.cv_results_['params']) * self.cv
+
+            results.append(round_results[['params', 'mean_test_score', 'std_test_score']])
+            self.n_fits += round_fits
+            search_round += 1
+            if round_fits:
+                round_fit_seconds = (time.perf_counter() - round_start) / round_fits
+                fit_seconds = round_fit_seconds if fit_seconds is None else max(fit_seconds, round_fit_seconds)
+
+            elapsed = time.perf_counter() - start
+            if self.time_budget is None and self.max_fits is None:
+                break
+            if self.time_budget is None and round_fits == 0:
+                # Every candidate was cached, the search space is used up
+                break
+            if self.time_budget is not None and elapsed >= self.time_budget:
+                break
+
+        if not results:
+            raise ValueError(f"max_fits={self.max_fits} is too small for cv={self.cv}.")
+
+        self.search_results = pd.concat(results, ignore_index=True).sort_values('mean_test_score', ascending=False)
+        best_params = self.search_results['params'].iloc[0]
+
+        # ----- Refit best model on all cores -----
+        best_rf = RandomForestClassifier(n_jobs=self.n_jobs, random_state=self.random_state, **best_params)
+        with stage_profiler.stage('model.refit', rows=len(X_train)):
+            best_rf.fit(X_train, y_train)
+        self.search_time = time.perf_counter() - start
+
+        return best_rf, best_params
+
+    def cap_candidates(self, n_iter:int, max_fits:int) -> int:
+        """
+        Largest number of candidates (at most n_iter) whose search round runs at most max_fits fits.
+        """
+        n_iter = min(n_iter, max_fits // self.cv)
+        if self.search == 'halving':
+            # Successive halving evaluates the survivors again at every rung
+            while n_iter > 0 and halving_candidate_fits(n_iter) * self.cv > max_fits:
+                n_iter -= 1
+        return n_iter
+
+    def search_cached_candidates(self, rf:RandomForestClassifier, X_train:pd.DataFrame, y_train:pd.Series,
+                                 n_iter:int, seed:int, scores_key:str) -> tuple:
+        """
+        Random search round reusing the training cache: candidates are drawn as RandomizedSearchCV draws them,
+        and only those not evaluated yet on this training split (with the same forest seed) are cross-validated.
+        Returns: Round results (params, mean and std test score), number of fits run
+        """
+        cached_scores = self.training_cache.load_scores(scores_key)
+        candidates = list(ParameterSampler(self.param_dist, n_iter, random_state=seed))
+        new_candidates = [params for params in candidates if candidate_key(params, seed) not in cached_scores]
+
+        if new_candidates:
+            param_grid = [{name: [value] for name, value in params.items()} for params in new_candidates]
+            search = GridSearchCV(rf, param_grid=param_grid, cv=self.cv, refit=False, n_jobs=self.n_jobs)
+            search.fit(X_train, y_train)
+            new_scores = {candidate_key(params, seed): (mean, std) for params, mean, std in
+                          zip(search.cv_results_['params'], search.cv_results_['mean_test_score'],
+                              search.cv_results_['std_test_score'])}
+            self.training_cache.save_scores(scores_key, new_scores)
+            cached_scores.update(new_scores)
+
+        scores = [cached_scores[candidate_key(params, seed)] for params in candidates]
+        round_results = pd.DataFrame({'params': candidates,
+                                      'mean_test_score': [mean for mean, _ in scores],
+                                      'std_test_score': [std for _, std in scores]})
+        return round_results, len(new_candidates) * self.cv
+
+    def run_key(self, X:pd.DataFrame, y:pd.Series) -> str:
+        """
+        Training cache key of a run: training data and features, search settings and seeds.
+        """
+        return self.training_cache.key({
+            'data': fingerprint_frames(X, y),
+            'features': list(X.columns),
+            'split': {'test_size': 0.2, 'random_state': 42},
+            'search': self.search,
+            'param_dist': describe_param_dist(self.param_dist),
+            'n_iter': self.n_iter,
+            'cv': self.cv,
+            'time_budget': self.time_budget,
+            'max_fits': self.max_fits,
+            'random_state': self.random_state,
+            'sklearn': sklearn.__version__,
+        })
+
+    def learn_encodings(self, df:pd.DataFrame) -> tuple:
+        """
+        Category encodings learned from the training data, numbered from 1:
+        sites in sorted order, periods of day in chronological order (unknown periods last, sorted).
+        Returns: site_to_num, period_of_day_to_num
+        """
+        if self.partitions is not None:
+            sites, periods = self.partitions.sites, self.partitions.periods
+        else:
+            sites = sorted(str(site) for site in pd.unique(df['site']))
+            periods = [str(period) for period in pd.unique(df['period_of_day'])]
+
+        periods = sorted(periods, key=lambda period: (PERIODS_OF_DAY.index(period) if period in PERIODS_OF_DAY
+                                                      else len(PERIODS_OF_DAY), period))
+        site_to_num = {site: i + 1 for i, site in enumerate(sites)}
+        period_of_day_to_num = {period: i + 1 for i, period in enumerate(periods)}
+        return site_to_num, period_of_day_to_num
+
+    def encode_training_categories(self, df:pd.DataFrame) -> dict:
+        """
+        Encoded site and period_of_day columns of the training data.
+        With a partition index, each group's codes are filled in at its row positions.
+        Returns: Dictionary of encoded columns
+        """
+        if self.partitions is None:
+            return {'site': df['site'].astype(str).map(self.site_to_num),
+                    'period_of_day': df['period_of_day'].astype(str).map(self.period_of_day_to_num)}
+        if self.partitions.n_rows != len(df):
+            raise ValueError(f"The partition index was built on {self.partitions.n_rows} rows, got {len(df)}.")
+
+        site_codes = np.full(len(df), np.nan)
+        period_codes = np.full(len(df), np.nan)
+        for site, period in self.partitions.keys():
+            positions = self.partitions.positions(site, period)
+            site_codes[positions] = self.site_to_num[site]
+            period_codes[positions] = self.period_of_day_to_num[period]
+        return {'site': pd.Series(site_codes, index=df.index),
+                'period_of_day': pd.Series(period_codes, index=df.index)}
+
+    @stage_profiler.profiled('model.predict')
+    def predict_headcount(self, sites, periods, sales) -> np.ndarray:
+        """
+        Predicts the optimal headcount for a batch of planned shifts in one call.
+        sites, periods and sales are array-likes of the same length (or scalars, broadcast to the batch).
+        Returns: Numpy array of headcounts, with the broadcast shape of the inputs
+        """
+        sites, periods, sales, shape = broadcast_inputs(sites, periods, sales)
+        return self.model.predict(self.features(sites, periods, sales)).reshape(shape)
+
+    def features(self, sites, periods, sales) -> pd.DataFrame:
+        """
+        Builds the model features (encoded and in training order) for a batch of planned shifts.
+        Returns: Pandas dataframe
+        """
+        sites, periods, sales, _ = broadcast_inputs(sites, periods, sales)
+        features = {
+            'site': self.encode(sites, self.site_to_num, 'site'),
+            'period_of_day': self.encode(periods, self.period_of_day_to_num, 'period of day'),
+            'sales': sales,
+        }
+        return pd.DataFrame({name: features[name] for name in self.feature_names})
+
+    def encode(self, values:np.ndarray, mapping:dict, name:str) -> np.ndarray:
+        """
+        Encodes categorical values with the model encodings.
+        """
+        codes = pd.Series(values).map(mapping)
+        if codes.isna().any():
+            unknown = sorted(set(values[codes.isna().to_numpy()]))
+            raise ValueError(f"Unknown {name} {unknown}, the model was trained on {sorted(mapping)}.")
+        return codes.to_numpy()
+
+    def can_update(self, df:pd.DataFrame) -> bool:
+        """
+        Whether update() can warm-start the forest on df: all its sites, periods of day and headcount classes are
+        known to the model. Headcount classes can be missing from df (see update).
+        """
+        sites = set(df['site'].astype(str))
+        periods = set(df['period_of_day'].astype(str))
+        return (sites <= set(self.site_to_num) and periods <= set(self.period_of_day_to_num)
+                and bool(np.isin(df['headcount'].unique(), self.model.classes_).all()))
+
+    @stage_profiler.profiled('model.update')
+    def update(self, df:pd.DataFrame, n_trees:int=10, max_trees:int=None) -> None:
+        """
+        Warm-starts the forest with n_trees new trees trained on df (e.g. the latest optimal rows) instead of
+        retraining on the full history: the existing trees are kept, so the cost only depends on the size of df.
+        The new trees are grown as the forest grows its trees (same tree parameters, bootstrap sample of df),
+        on the forest's class encoding: a zero-weight row of every class is added to each tree's sample, so the trees
+        vote over all the classes of the forest even when df only has some of them (e.g. a day of data).
+        max_trees: drop the oldest trees beyond this number, so the forest follows the recent data.
+        """
+        if not self.can_update(df):
+            raise ValueError("Cannot warm-start the model on this data (unknown sites, periods of day or headcounts), "
+                             "please retrain it.")
+
+        classes = self.model.classes_
+        n_rows = len(df)
+        X = self.features(df['site'], df['period_of_day'], df['sales']).to_numpy(dtype=np.float32)
+        X = np.vstack([X, np.empty((len(classes), X.shape[1]), dtype=np.float32)])
+        # The forest's trees are trained on the class positions (0 to n_classes - 1)
+        y = np.concatenate([np.searchsorted(classes, df['headcount'].to_numpy()), np.arange(len(classes))])
+        y = y.astype(np.float64)
+
+        random_state = self.model.random_state
+        rng = np.random.RandomState(random_state + len(self.model.estimators_) if isinstance(random_state, int) else None)
+        tree_params = {name: getattr(self.model, name) for name in self.model.estimator_params if name != 'random_state'}
+        max_samples = self.model.max_samples
+        n_samples = (n_rows if max_samples is None else max_samples if isinstance(max_samples, int)
+                     else max(round(n_rows * max_samples), 1))
+
+        for _ in range(n_trees):
+            weights = np.zeros(len(y))
+            if self.model.bootstrap:
+                weights[:n_rows] = np.bincount(rng.randint(0, n_rows, n_samples), minlength=n_rows)
+            else:
+                weights[:n_rows] = 1
+            # The zero-weight rows share the features of a sampled row, so they never end up alone in a leaf
+            X[n_rows:] = X[np.argmax(weights[:n_rows])]
+            tree = DecisionTreeClassifier(**tree_params, random_state=rng.randint(np.iinfo(np.int32).max))
+            tree.fit(X, y, sample_weight=weights)
+            self.model.estimators_.append(tree)
+
+        if max_trees is not None and len(self.model.estimators_) > max_trees:
+            self.model.estimators_ = self.model.estimators_[-max_trees:]
+        self.model.set_params(n_estimators=len(self.model.estimators_))
+
+    def save(self, filepath:str) -> None:
+        """
+        Saves the trained model and its category encodings as a versioned artifact.
+        The file is not compressed, so its arrays can be memory-mapped by load(). It is written next to
+        filepath and renamed into place, so a model memory-mapped from filepath can be saved over it.
+        """
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        artifact = {
+            'artifact_version': ARTIFACT_VERSION,
+            'sklearn_version': sklearn.__version__,
+            'model': self.model,
+            'feature_names': self.feature_names,
+            'site_to_num': self.site_to_num,
+            'period_of_day_to_num': self.period_of_day_to_num,
+        }
+        joblib.dump(artifact, filepath + ".tmp")
+        os.replace(filepath + ".tmp", filepath)
+
+    @classmethod
+    def load(cls, filepath:str, mmap:bool=True) -> "ModelOptimalHeadcount":
+        """
+        Loads a model saved with save(), without retraining.
+        With mmap, the numpy arrays of the artifact are memory-mapped read-only instead of read into memory
+        (sklearn still copies the tree nodes into each tree when unpickling).
+        Returns: ModelOptimalHeadcount ready for predict_headcount()
+        """
+        artifact = joblib.load(filepath, mmap_mode='r' if mmap else None)
+        if artifact.get('artifact_version') != ARTIFACT_VERSION:
+            raise ValueError(f"Model artifact {filepath} has version {artifact.get('artifact_version')}, "
+                             f"expected {ARTIFACT_VERSION}. Please retrain the model.")
+        if artifact.get('sklearn_version') != sklearn.__version__:
+            raise ValueError(f"Model artifact {filepath} was saved with scikit-learn {artifact.get('sklearn_version')}, "
+                             f"running {sklearn.__version__}. Please retrain the model.")
+
+        model = cls.__new__(cls)
+        model.df_training = None
+        model.partitions = None
+        model.model = artifact['model']
+        model.feature_names = artifact['feature_names']
+        model.site_to_num = artifact['site_to_num']
+        model.period_of_day_to_num = artifact['period_of_day_to_num']
+        return model
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+
+class PartitionIndex:
+    """
+    Maps each (site, period_of_day) group of a dataframe to the positions of its rows.
+    Built once with a single stable sort, so each group is a contiguous slice of one position array
+    (and each site a contiguous run of groups): group lookups are O(1) instead of a boolean mask scan.
+    """
+    def __init__(self, df:pd.DataFrame) -> None:
+        site_codes, sites = pd.factorize(df['site'], sort=True)
+        period_codes, periods = pd.factorize(df['period_of_day'], sort=True)
+        self.sites = [str(site) for site in sites]
+        self.periods = [str(period) for period in periods]
+        self.site_numbers = {site: i for i, site in enumerate(self.sites)}
+        self.period_numbers = {period: i for i, period in enumerate(self.periods)}
+        self.n_rows = len(df)
+
+        group = site_codes.astype(np.int64) * len(self.periods) + period_codes
+        self.order = np.argsort(group, kind='stable')
+        counts = np.bincount(group, minlength=len(self.sites) * len(self.periods))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    def site_number(self, site:str) -> int:
+        """
+        Position of a site in the sorted sites.
+        """
+        try:
+            return self.site_numbers[site]
+        except KeyError:
+            raise KeyError(f"Cannot find site {site} in the database.")
+
+    def period_number(self, period_of_day:str) -> int:
+        """
+        Position of a period of day in the sorted periods.
+        """
+        try:
+            return self.period_numbers[period_of_day]
+        except KeyError:
+            raise KeyError(f"Cannot find period of day {period_of_day} in the database.")
+
+    def keys(self) -> list:
+        """
+        Non-empty (site, period_of_day) groups, sorted.
+        """
+        return [(site, period) for i, site in enumerate(self.sites) for j, period in enumerate(self.periods)
+                if self.offsets[i * len(self.periods) + j + 1] > self.offsets[i * len(self.periods) + j]]
+
+    def positions(self, site:str=None, period_of_day:str=None) -> np.ndarray:
+        """
+        Row positions of a group, of a site (all periods) or of a period of day (all sites).
+        Positions are ascending within each (site, period_of_day) group.
+        Returns: Numpy array of positions (a view, for a group or a site)
+        """
+        n_periods = len(self.periods)
+        if site is not None and period_of_day is not None:
+            group = self.site_number(site) * n_periods + self.period_number(period_of_day)
+            return self.order[self.offsets[group]:self.offsets[group + 1]]
+        if site is not None:
+            first_group = self.site_number(site) * n_periods
+            return self.order[self.offsets[first_group]:self.offsets[first_group + n_periods]]
+        if period_of_day is not None:
+            period = self.period_number(period_of_day)
+            return np.concatenate([self.positions(site, self.periods[period]) for site in self.sites])
+        return self.order
+
+    def take(self, df:pd.DataFrame, site:str=None, period_of_day:str=None) -> pd.DataFrame:
+        """
+        Rows of df (the dataframe the index was built on) for a group, site or period of day.
+        """
+        if len(df) != self.n_rows:
+            raise ValueError(f"The index was built on {self.n_rows} rows, got {len(df)}.")
+        return df.iloc[self.positions(site, period_of_day)]
+
+    def describe(self, df:pd.DataFrame, column:str) -> pd.DataFrame:
+        """
+        Same table as df.groupby(['site','period_of_day'])[column].describe(), from the index.
+        """
+        values = df[column].to_numpy(dtype=np.float64)
+        rows = {}
+        for site, period in self.keys():
+            group_values = values[self.positions(site, period)]
+            group_values = group_values[~np.isnan(group_values)]
+            if len(group_values) == 0:
+                rows[(site, period)] = [0.0] + [np.nan] * 7
+                continue
+            quartiles = np.quantile(group_values, [0.25, 0.5, 0.75])
+            std = group_values.std(ddof=1) if len(group_values) > 1 else np.nan
+            rows[(site, period)] = [float(len(group_values)), group_values.mean(), std, group_values.min(),
+                                    *quartiles, group_values.max()]
+
+        df_describe = pd.DataFrame.from_dict(rows, orient='index',
+                                             columns=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+        df_describe.index = pd.MultiIndex.from_tuples(df_describe.index, names=['site', 'period_of_day'])
+        return df_describe
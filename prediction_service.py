@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Reason phrases of the HTTP status codes the service answers with
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                500: "Internal Server Error"}
+
+
+def load_predictor(filepath:str):
+    """
+    Loads a trained model for serving: a sharded model directory (ShardedHeadcountModel),
+    a lookup table (.npz, HeadcountLookup) or a model artifact (ModelOptimalHeadcount).
+    Returns: Object with a predict_headcount(sites, periods, sales) method
+    """
+    if os.path.isdir(filepath):
+        from sharded_model import ShardedHeadcountModel
+        return ShardedHeadcountModel.load(filepath)
+    if filepath.endswith(".npz"):
+        from headcount_lookup import HeadcountLookup
+        return HeadcountLookup.load(filepath)
+    from model_optimal_headcount import ModelOptimalHeadcount
+    return ModelOptimalHeadcount.load(filepath)
+
+
+async def read_http_message(reader:asyncio.StreamReader) -> tuple:
+    """
+    Reads one HTTP/1.1 request or response (start line, headers and Content-Length body).
+    Returns: Start line, dictionary of lower-cased headers, body bytes; or None if the connection was closed
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            raise
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return lines[0], headers, body
+
+
+class MicroBatcher:
+    """
+    Groups concurrent prediction requests into micro-batches, each scored with one vectorized predict call.
+    A batch is closed once it holds max_batch_size rows or max_wait seconds after its first request,
+    whichever comes first. Scoring runs in a worker thread, so requests keep being accepted meanwhile.
+    If a batch fails (e.g. one request has an unknown site), its requests are scored one by one so only
+    the faulty ones get the error; a failing request never stops the batching loop.
+    """
+    def __init__(self, predict, max_batch_size:int=256, max_wait:float=0.005) -> None:
+        self.predict_fn = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.n_batches = 0
+        self.n_rows = 0
+
+    async def predict(self, sites:np.ndarray, periods:np.ndarray, sales:np.ndarray) -> np.ndarray:
+        """
+        Queues the rows of one request and waits for their headcounts.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sites, periods, sales, future))
+        return await future
+
+    async def run(self) -> None:
+        """
+        Batching loop: collects the queued requests into batches and scores them, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            n_rows = len(requests[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_rows < self.max_batch_size:
+                try:
+                    request = self.queue.get_nowait() if self.queue.qsize() else \
+                        await asyncio.wait_for(self.queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                n_rows += len(request[0])
+            await self.score(requests)
+
+    async def score(self, requests:list) -> None:
+        """
+        Scores a batch of requests in one predict call and hands each request its slice of the result.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            sites, periods, sales = (np.concatenate([request[i] for request in requests]) for i in range(3))
+            headcounts = await loop.run_in_executor(self.executor, self.predict_fn, sites, periods, sales)
+        except Exception:
+            # Isolate the faulty requests
+            for request in requests:
+                try:
+                    headcounts = await loop.run_in_executor(self.executor, self.predict_fn, *request[:3])
+                except Exception as error:
+                    if not request[3].done():
+                        request[3].set_exception(error)
+                else:
+                    if not request[3].done():
+                        request[3].set_result(headcounts)
+            return
+
+        self.n_batches += 1
+        self.n_rows += len(sites)
+        lengths = [len(request[0]) for request in requests]
+        ends = np.cumsum(lengths)
+        for request, start, end in zip(requests, ends - lengths, ends):
+            if not request[3].done():
+                request[3].set_result(headcounts[start:end])
+
+
+class PredictionService:
+    """
+    Local HTTP/1.1 service (asyncio, keep-alive) serving a trained headcount model through a MicroBatcher.
+
+    Endpoints:
+    - POST /predict with a JSON body {"site": ..., "period_of_day": ..., "sales": ...}, each a value or a list
+      (scalars are broadcast): returns {"headcount": value or list}.
+    - GET /health: returns the status and the number of batches and rows scored so far.
+    """
+    def __init__(self, predictor, host:str="127.0.0.1", port:int=8080, max_batch_size:int=256,
+                 max_wait:float=0.005) -> None:
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(predictor.predict_headcount, max_batch_size, max_wait)
+
+    async def serve(self) -> None:
+        """
+        Runs the service until cancelled.
+        """
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        batching = asyncio.create_task(self.batcher.run())
+        print(f"  -> Serving on http://{self.host}:{self.port} (max batch {self.batcher.max_batch_size} rows, "
+              f"max wait {self.batcher.max_wait * 1e3:g} ms)", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching.cancel()
+
+    async def handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter) -> None:
+        """
+        Answers the requests of one connection, in order, until the client closes it.
+        """
+        try:
+            while True:
+                message = await read_http_message(reader)
+                if message is None:
+                    break
+                start_line, headers, body = message
+                method, path = start_line.split(" ")[:2]
+                status, payload = await self.route(method, path, body)
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method:str, path:str, body:bytes) -> tuple:
+        """
+        Returns: HTTP status, JSON payload
+        """
+        if path == "/health":
+            return 200, {"status": "ok", "batches": self.batcher.n_batches, "rows": self.batcher.n_rows}
+        if path != "/predict":
+            return 404, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST /predict"}
+
+        try:
+            query = json.loads(body)
+            scalar = not any(isinstance(query[key], list) for key in ("site", "period_of_day", "sales"))
+            fields = [np.asarray(query["site"], dtype=object), np.asarray(query["period_of_day"], dtype=object),
+                      np.asarray(query["sales"], dtype=np.float64)]
+            if any(field.ndim > 1 for field in fields):
+                return 400, {"error": "Fields must be a value or a flat list"}
+            sites, periods, sales = (field.ravel() for field in np.broadcast_arrays(*map(np.atleast_1d, fields)))
+            headcounts = await self.batcher.predict(sites, periods, sales)
+        except KeyError as error:
+            return 400, {"error": f"Missing field {error}"}
+        except (ValueError, TypeError) as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+
+        headcounts = headcounts.tolist()
+        return 200, {"headcount": headcounts[0] if scalar else headcounts}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headcount prediction service with request micro-batching.")
+    parser.add_argument('--model', default='models/rf_model.joblib',
+                        help="Model artifact, sharded model directory or lookup table (.npz).")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=256, help="Maximum rows per predict call.")
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="Maximum wait for a batch to fill up.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    predictor = load_predictor(args.model)
+    print(f"  -> Loaded {args.model} in {time.perf_counter() - start:.2f} s", flush=True)
+
+    service = PredictionService(predictor, args.host, args.port, args.max_batch_size, args.max_wait_ms / 1e3)
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from data_processor import PROFITABILITY_LABELS
+from partition_index import PartitionIndex
+
+
+class ScenarioEngine:
+    """
+    What-if engine over grids of tax rates, hourly wages and optimal profitability thresholds.
+    Profit, profit per head and profitability class are computed for every (scenario, row) pair in one
+    broadcast pass (same formulas as DataProcessor) and summarised per scenario, site and period of day.
+    Rows are processed in chunks of at most max_cells (money scenario, row) pairs, so memory is bounded
+    whatever the size of the grid: about 8 bytes per cell for each working array.
+
+    df needs the site, period_of_day, sales and headcount columns (e.g. DataProcessor.df_training_clean).
+    partitions: optional (site, period_of_day) PartitionIndex of df, built here if not given.
+    """
+    def __init__(self, df:pd.DataFrame, partitions:PartitionIndex=None, max_cells:int=2_000_000) -> None:
+        self.partitions = PartitionIndex(df) if partitions is None else partitions
+        self.sales = df['sales'].to_numpy(dtype=np.float64)
+        self.headcount = df['headcount'].to_numpy(dtype=np.float64)
+        self.max_cells = max_cells
+
+    def run(self, tax_rates, hourly_wages, thresholds) -> pd.DataFrame:
+        """
+        Evaluates every combination of tax rate, hourly wage and threshold.
+        Returns: Summary dataframe indexed by (tax_rate, hourly_wage, threshold, site, period_of_day), with
+        the number of rows, total and mean profit, mean profit per head and the rows per profitability class
+        """
+        tax_rates = np.asarray(tax_rates, dtype=np.float64)
+        hourly_wages = np.asarray(hourly_wages, dtype=np.float64)
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+
+        # Money scenarios (tax rate x wage) on the first axis, thresholds only change the classes
+        tax_grid, wage_grid = (grid.ravel() for grid in np.meshgrid(tax_rates, hourly_wages, indexing='ij'))
+        tax_grid, wage_grid = tax_grid[:, None], wage_grid[:, None]
+
+        # Thresholds in increasing order: a profit per head is below the thresholds from its insertion point on
+        order = np.argsort(thresholds, kind='stable')
+        sorted_thresholds = thresholds[order]
+
+        groups = self.partitions.keys()
+        n_money = len(tax_grid)
+        chunksize = max(1, self.max_cells // n_money)
+        n_rows = np.zeros(len(groups), dtype=np.int64)
+        profit_sums = np.zeros((len(groups), n_money))
+        profit_per_head_sums = np.zeros((len(groups), n_money))
+        negative = np.zeros((len(groups), n_money), dtype=np.int64)
+        sub_optimal = np.zeros((len(groups), len(thresholds), n_money), dtype=np.int64)
+
+        for g, (site, period) in enumerate(groups):
+            positions = self.partitions.positions(site, period)
+            for start in range(0, len(positions), chunksize):
+                rows = positions[start:start + chunksize]
+                sales = self.sales[rows][None, :]
+                headcount = self.headcount[rows][None, :]
+
+                # Shape (money scenarios, rows)
+                total_profit = sales - (sales * tax_grid + headcount * wage_grid)
+                profit_per_head = total_profit / headcount
+
+                n_rows[g] += len(rows)
+                profit_sums[g] += total_profit.sum(axis=1)
+                profit_per_head_sums[g] += profit_per_head.sum(axis=1)
+                negative[g] += (profit_per_head <= 0).sum(axis=1)
+                # Positive profits per head, counted per money scenario and number of thresholds at or below them;
+                # the rows below sorted threshold j are those with at most j thresholds at or below them
+                money, _ = np.nonzero(profit_per_head > 0)
+                n_at_or_below = np.searchsorted(sorted_thresholds, profit_per_head[profit_per_head > 0], side='right')
+                counts = np.bincount(money * (len(thresholds) + 1) + n_at_or_below,
+                                     minlength=n_money * (len(thresholds) + 1)).reshape(n_money, -1)
+                sub_optimal[g][order] += np.cumsum(counts[:, :-1], axis=1).T
+
+        return self.summarise(groups, tax_grid.ravel(), wage_grid.ravel(), thresholds,
+                              n_rows, profit_sums, profit_per_head_sums, negative, sub_optimal)
+
+    def summarise(self, groups:list, tax_grid:np.ndarray, wage_grid:np.ndarray, thresholds:np.ndarray,
+                  n_rows, profit_sums, profit_per_head_sums, negative, sub_optimal) -> pd.DataFrame:
+        """
+        Builds the per-scenario summary table from the accumulated sums and counts.
+        Rows are ordered by money scenario, then threshold, then group.
+        """
+        n_groups, n_thresholds, n_money = len(groups), len(thresholds), len(tax_grid)
+
+        # Everything to shape (money scenarios, thresholds, groups), then flattened
+        def expand(values:np.ndarray) -> np.ndarray:
+            return np.broadcast_to(values, (n_money, n_thresholds, n_groups)).ravel()
+
+        rows = expand(n_rows[None, None, :])
+        negative = expand(negative.T[:, None, :])
+        sub_optimal = expand(sub_optimal.transpose(2, 1, 0))
+        optimal = rows - negative - sub_optimal
+        profit_sums = expand(profit_sums.T[:, None, :])
+        profit_per_head_sums = expand(profit_per_head_sums.T[:, None, :])
+
+        index = pd.MultiIndex.from_arrays([
+            expand(tax_grid[:, None, None]),
+            expand(wage_grid[:, None, None]),
+            expand(thresholds[None, :, None]),
+            np.tile([site for site, _ in groups], n_money * n_thresholds),
+            np.tile([period for _, period in groups], n_money * n_thresholds),
+        ], names=['tax_rate', 'hourly_wage', 'threshold', 'site', 'period_of_day'])
+
+        return pd.DataFrame({
+            'rows': rows,
+            'total_profit': profit_sums,
+            'mean_total_profit': profit_sums / rows,
+            'mean_profit_per_headcount': profit_per_head_sums / rows,
+            PROFITABILITY_LABELS[0]: negative,
+            PROFITABILITY_LABELS[1]: sub_optimal,
+            PROFITABILITY_LABELS[2]: optimal,
+            'optimal_share': optimal / rows,
+        }, index=index)
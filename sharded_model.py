@@ -0,0 +1,159 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from model_optimal_headcount import ARTIFACT_VERSION, ModelOptimalHeadcount, broadcast_inputs
+
+
+def train_shard(df:pd.DataFrame, model_kwargs:dict) -> ModelOptimalHeadcount:
+    """
+    Trains the model of one shard in a worker process.
+    The training data is dropped before the model is sent back.
+    """
+    model = ModelOptimalHeadcount(df, **model_kwargs)
+    model.df_training = None
+    model.partitions = None
+    return model
+
+
+class ShardedHeadcountModel:
+    """
+    One ModelOptimalHeadcount per site (or per site group), trained in parallel across a process pool.
+    predict_headcount routes every row to the shard of its site, so training and prediction scale
+    with the number of sites and cores.
+
+    shard_of: optional mapping of site to shard name (sites not in it get their own shard).
+    n_jobs: training processes and prediction threads (None for all cores).
+    partitions: optional (site, period_of_day) PartitionIndex of df, to slice the shards without a scan.
+    Other keyword arguments are passed to each shard's ModelOptimalHeadcount.
+
+    update() folds in new data shard by shard, so a daily update only touches the sites that have new rows.
+    """
+    def __init__(self, df:pd.DataFrame, shard_of:dict=None, n_jobs:int=None, partitions=None, **model_kwargs) -> None:
+        sites = partitions.sites if partitions is not None else sorted(str(site) for site in pd.unique(df['site']))
+        shard_of = {} if shard_of is None else shard_of
+        self.shard_of = {site: str(shard_of.get(site, site)) for site in sites}
+        self.n_jobs = n_jobs
+        self.model_kwargs = model_kwargs
+        self.shards = self.train_shards(self.shard_frames(df, partitions))
+
+    def shard_frames(self, df:pd.DataFrame, partitions) -> dict:
+        """
+        Training rows of every shard.
+        """
+        shard_sites = {}
+        for site, shard in self.shard_of.items():
+            shard_sites.setdefault(shard, []).append(site)
+
+        if partitions is not None:
+            return {shard: df.iloc[np.concatenate([partitions.positions(site=site) for site in sites])]
+                    for shard, sites in shard_sites.items()}
+        site = df['site'].astype(str)
+        return {shard: df[site.isin(sites).to_numpy()] for shard, sites in shard_sites.items()}
+
+    def shard_sites(self, shard:str) -> list:
+        """
+        Sites routed to a shard.
+        """
+        return [site for site, site_shard in self.shard_of.items() if site_shard == shard]
+
+    def train_shards(self, shard_frames:dict) -> dict:
+        """
+        Trains the shards in parallel on their training rows. Each shard's search runs single-process
+        to avoid oversubscription.
+        Returns: Dictionary of shard name to trained model
+        """
+        model_kwargs = {'verbose': False, **self.model_kwargs, 'n_jobs': 1}
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+            futures = {shard: executor.submit(train_shard, df_shard, model_kwargs)
+                       for shard, df_shard in shard_frames.items()}
+            return {shard: future.result() for shard, future in futures.items()}
+
+    def update(self, df_delta:pd.DataFrame, history=None, n_trees:int=10, max_trees:int=None) -> dict:
+        """
+        Updates the shards of the sites in df_delta (the new optimal rows), leaving the other shards untouched.
+        A shard is warm-started with n_trees trees on its new rows (see ModelOptimalHeadcount.update) when it can be.
+        Shards of new sites, or whose new rows have unknown periods of day or headcounts, are retrained
+        in parallel on history(sites): a callable returning all the optimal rows of the given sites, delta included
+        (e.g. IncrementalStore.load with optimal_only=True).
+        Returns: Dictionary of updated shard name to 'warm_start' or 'refit'
+        """
+        for site in sorted(str(site) for site in pd.unique(df_delta['site'])):
+            self.shard_of.setdefault(site, site)
+
+        delta_frames = {shard: df_shard for shard, df_shard in self.shard_frames(df_delta, None).items() if len(df_shard)}
+        refit = [shard for shard, df_shard in delta_frames.items()
+                 if shard not in self.shards or not self.shards[shard].can_update(df_shard)]
+        if refit and history is None:
+            raise ValueError(f"Shards {refit} need to be retrained, please pass the training history.")
+
+        for shard, df_shard in delta_frames.items():
+            if shard not in refit:
+                self.shards[shard].update(df_shard, n_trees=n_trees, max_trees=max_trees)
+        if refit:
+            self.shards.update(self.train_shards({shard: history(self.shard_sites(shard)) for shard in refit}))
+
+        return {shard: 'refit' if shard in refit else 'warm_start' for shard in delta_frames}
+
+    def predict_headcount(self, sites, periods, sales) -> np.ndarray:
+        """
+        Same as ModelOptimalHeadcount.predict_headcount, with every row scored by the shard of its site.
+        The shards are scored in parallel threads.
+        Returns: Numpy array of headcounts, with the broadcast shape of the inputs
+        """
+        sites, periods, sales, shape = broadcast_inputs(sites, periods, sales)
+
+        shards = pd.Series(sites).map(self.shard_of)
+        missing = shards.isna().to_numpy()
+        if missing.any():
+            raise ValueError(f"Unknown site {sorted(set(sites[missing]))}, the model was trained on {sorted(self.shard_of)}.")
+
+        shard_names, shard_rows = np.unique(shards.to_numpy(dtype=str), return_inverse=True)
+        rows_of = {shard: np.flatnonzero(shard_rows == i) for i, shard in enumerate(shard_names)}
+
+        headcounts = np.empty(len(sites), dtype=np.int64)
+        with ThreadPoolExecutor(max_workers=self.n_jobs) as executor:
+            futures = {shard: executor.submit(self.shards[shard].predict_headcount, sites[rows], periods[rows], sales[rows])
+                       for shard, rows in rows_of.items()}
+            for shard, future in futures.items():
+                headcounts[rows_of[shard]] = future.result()
+        return headcounts.reshape(shape)
+
+    def save(self, directory:str) -> None:
+        """
+        Saves every shard as a model artifact, plus a manifest with the site to shard routing.
+        """
+        os.makedirs(directory, exist_ok=True)
+        shard_files = {}
+        for i, (shard, model) in enumerate(sorted(self.shards.items())):
+            shard_files[shard] = f"shard_{i}.joblib"
+            model.save(os.path.join(directory, shard_files[shard]))
+
+        manifest = {'artifact_version': ARTIFACT_VERSION, 'shard_of': self.shard_of, 'shard_files': shard_files}
+        manifest_path = os.path.join(directory, "manifest.json")
+        with open(manifest_path + ".tmp", 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    @classmethod
+    def load(cls, directory:str, mmap:bool=True, n_jobs:int=None, **model_kwargs) -> "ShardedHeadcountModel":
+        """
+        Loads a sharded model saved with save(), without retraining.
+        model_kwargs are used for the shards retrained by update().
+        """
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest.get('artifact_version') != ARTIFACT_VERSION:
+            raise ValueError(f"Sharded model {directory} has version {manifest.get('artifact_version')}, "
+                             f"expected {ARTIFACT_VERSION}. Please retrain the model.")
+
+        model = cls.__new__(cls)
+        model.shard_of = manifest['shard_of']
+        model.n_jobs = n_jobs
+        model.model_kwargs = model_kwargs
+        model.shards = {shard: ModelOptimalHeadcount.load(os.path.join(directory, filename), mmap=mmap)
+                        for shard, filename in manifest['shard_files'].items()}
+        return model
@@ -0,0 +1,238 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:         # Not available on Windows
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+# Profiler the pipeline stages report to (set by activate), None when profiling is off
+active_profiler = None
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the process so far (since the last reset_peak_rss on Linux), in MB.
+    Returns: Peak RSS, or None if it cannot be read on this platform
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1e3
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 1e6 if sys.platform == "darwin" else max_rss / 1e3
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak RSS of the process to its current RSS (Linux only).
+    Returns: True if the peak was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def n_rows(value) -> int:
+    """
+    Number of rows of a dataframe, series or array, None for anything else.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+class StageProfiler:
+    """
+    Records the wall time, CPU time, rows processed and peak RSS of named pipeline stages.
+    Stages can be nested (e.g. the hyperparameter search inside model training): each record keeps
+    the name of its parent stage and its time outside of child stages (self_wall_s), and a parent's
+    peak RSS covers its children.
+
+    cprofile_stage: name of a stage to also run under cProfile (every run of it is captured);
+    the stats are written to cprofile_dir as <stage>.prof (open with pstats or snakeviz).
+
+    CPU time and peak RSS are those of the current process: work done in worker processes
+    (e.g. parallel plot rendering) only shows up in the wall time of the stage that waits for it.
+
+    Stages can run in several threads (e.g. the shards of a sharded model scored in a thread pool):
+    each thread nests its stages in its own stack, so a stage run in a worker thread has no parent
+    (its time also shows up in the stage waiting for it). The peak RSS of concurrent stages is shared,
+    and only one thread at a time runs under cProfile.
+    """
+    def __init__(self, cprofile_stage:str=None, cprofile_dir:str="profiles") -> None:
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_dir = cprofile_dir
+        self.records = []
+        self.threads = threading.local()
+        self.lock = threading.Lock()
+        self.cprofile = None
+        self.cprofiling = False
+        self.start = time.perf_counter()
+
+    @property
+    def open_stages(self) -> list:
+        """
+        Stages open in the current thread, innermost last.
+        """
+        if not hasattr(self.threads, 'open_stages'):
+            self.threads.open_stages = []
+        return self.threads.open_stages
+
+    @contextlib.contextmanager
+    def stage(self, name:str, rows:int=None):
+        """
+        Context manager measuring one run of a stage. Yields the stage record, so rows can be set
+        once they are known (record['rows'] = ...).
+        """
+        open_stages = self.open_stages
+        # The peak so far belongs to the enclosing stages, before it is reset for this one
+        peak = peak_rss_mb()
+        for parent in open_stages:
+            parent['peak_rss_mb'] = max(parent['peak_rss_mb'] or 0, peak or 0)
+        reset_peak_rss()
+
+        record = {'name': name,
+                  'parent': open_stages[-1]['name'] if open_stages else None,
+                  'depth': len(open_stages),
+                  'start_s': round(time.perf_counter() - self.start, 4),
+                  'rows': rows,
+                  'peak_rss_mb': None,
+                  'children_wall_s': 0.0}
+        with self.lock:
+            self.records.append(record)
+        open_stages.append(record)
+
+        # Runs of the cProfile stage accumulate in one profile (nested runs are covered by the outer one)
+        profile = None
+        if name == self.cprofile_stage:
+            with self.lock:
+                if not self.cprofiling:
+                    if self.cprofile is None:
+                        self.cprofile = cProfile.Profile()
+                    profile = self.cprofile
+                    self.cprofiling = True
+            if profile is not None:
+                profile.enable()
+
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_s'] = round(time.perf_counter() - wall_start, 4)
+            record['self_wall_s'] = round(record['wall_s'] - record.pop('children_wall_s'), 4)
+            record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+            if profile is not None:
+                profile.disable()
+                with self.lock:
+                    record['cprofile'] = self.dump_cprofile(name)
+                    self.cprofiling = False
+            record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0, peak_rss_mb() or 0) or None
+            open_stages.pop()
+            if open_stages:
+                parent = open_stages[-1]
+                parent['children_wall_s'] += record['wall_s']
+                parent['peak_rss_mb'] = max(parent['peak_rss_mb'] or 0, record['peak_rss_mb'] or 0)
+
+    def dump_cprofile(self, name:str) -> str:
+        """
+        Writes the cProfile stats captured so far for the cProfile stage.
+        Returns: Path of the stats file
+        """
+        os.makedirs(self.cprofile_dir, exist_ok=True)
+        filepath = os.path.join(self.cprofile_dir, f"{name}.prof")
+        self.cprofile.dump_stats(filepath)
+        return filepath
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Total wall, self and CPU time, rows and peak RSS per stage name, by self time.
+        """
+        with self.lock:
+            df = pd.DataFrame(self.records)
+        if df.empty:
+            return df
+        return (df.groupby('name', sort=False)
+                  .agg(runs=('name', 'size'), wall_s=('wall_s', 'sum'), self_wall_s=('self_wall_s', 'sum'),
+                       cpu_s=('cpu_s', 'sum'), rows=('rows', 'max'), peak_rss_mb=('peak_rss_mb', 'max'))
+                  .sort_values('self_wall_s', ascending=False))
+
+    def save(self, filepath:str, meta:dict=None) -> None:
+        """
+        Writes the trace as JSON: the stage records in start order, plus the total wall time and any meta.
+        """
+        directory = os.path.dirname(filepath)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        trace = {'meta': {**(meta or {}), 'total_wall_s': round(time.perf_counter() - self.start, 4),
+                          'peak_rss_mb': max((r['peak_rss_mb'] or 0 for r in self.records), default=None)},
+                 'stages': self.records}
+        with open(filepath, 'w') as f:
+            json.dump(trace, f, indent=2)
+
+    def report(self, filepath:str=None, meta:dict=None) -> None:
+        """
+        Prints the per-stage summary, and writes the JSON trace to filepath if given.
+        """
+        print("\n----- Profile -----")
+        print(self.summary().to_string())
+        if filepath is not None:
+            self.save(filepath, meta)
+            print(f"  -> Trace written to {filepath}")
+
+
+def activate(profiler:StageProfiler) -> None:
+    """
+    Makes the pipeline stages report to profiler (None switches profiling off).
+    """
+    global active_profiler
+    active_profiler = profiler
+
+
+def stage(name:str, rows:int=None):
+    """
+    Measures a block as a pipeline stage on the active profiler; does nothing when profiling is off.
+    Yields the stage record (a throwaway dictionary when profiling is off).
+    """
+    if active_profiler is None:
+        return contextlib.nullcontext({})
+    return active_profiler.stage(name, rows)
+
+
+def profiled(name:str):
+    """
+    Decorator measuring each call of a function as a pipeline stage. The rows processed are those of
+    the returned frame or array, or else of the first frame or array argument.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if active_profiler is None:
+                return func(*args, **kwargs)
+            with active_profiler.stage(name) as record:
+                output = func(*args, **kwargs)
+                record['rows'] = n_rows(output)
+                if record['rows'] is None:
+                    record['rows'] = next((n for n in map(n_rows, list(args) + list(kwargs.values()))
+                                           if n is not None), None)
+            return output
+        return wrapper
+    return decorator
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+
+# Group keys of the summaries
+GROUP_KEYS = ['site', 'period_of_day']
+
+# Absolute values below this are counted as zero by the quantile sketch
+MIN_SKETCH_VALUE = 1e-9
+
+
+def group_codes(df:pd.DataFrame) -> tuple:
+    """
+    Integer (site, period_of_day) group of every row, coded once for all the aggregates
+    (categorical keys are coded from their categories, without hashing the values).
+    Returns: Numpy array of group codes (-1 for rows with a missing key), site labels, period labels
+    """
+    codes, labels = [], []
+    for key in GROUP_KEYS:
+        key_codes, uniques = pd.factorize(df[key])
+        codes.append(key_codes.astype(np.int64))
+        labels.append(np.asarray(uniques).astype(str))
+    groups = codes[0] * len(labels[1]) + codes[1]
+    groups[(codes[0] < 0) | (codes[1] < 0)] = -1
+    return groups, labels[0], labels[1]
+
+
+class SummarySketch:
+    """
+    Mergeable one-pass summary of numeric columns per (site, period_of_day) group.
+    Count, mean, std, min and max are exact (from count, sum, sum of squares, min and max).
+    Quantiles are approximate, from a log-bucket histogram (DDSketch): every non-zero value falls in bucket
+    ceil(log_gamma(|value|)) of its sign, with gamma = (1 + relative_accuracy) / (1 - relative_accuracy), so a
+    quantile estimate is within relative_accuracy of a value of the data around that rank.
+    counts: optional dictionary of categorical column to labels, whose rows are counted per group
+    (e.g. {'profitability': PROFITABILITY_LABELS}).
+
+    update() folds in a chunk of rows and merge() combines sketches built elsewhere (other chunks, files or
+    worker processes) without revisiting any row; the memory used depends on the value range, not on the rows.
+    n_rows counts the rows summarised so far.
+    """
+    def __init__(self, columns:list, relative_accuracy:float=0.01, quantiles:tuple=(0.25, 0.5, 0.75),
+                 counts:dict=None) -> None:
+        self.columns = list(columns)
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.quantiles = quantiles
+        self.counts = {column: list(labels) for column, labels in (counts or {}).items()}
+        self.moments = None
+        self.buckets = {column: None for column in self.columns}
+        self.n_rows = 0
+
+    def update(self, df:pd.DataFrame) -> "SummarySketch":
+        """
+        Adds the rows of a dataframe (with the site, period_of_day, summarised and counted columns) to the summary.
+        Returns: The sketch itself
+        """
+        self.n_rows += len(df)
+        groups, sites, periods = group_codes(df)
+        n_groups = len(sites) * len(periods)
+        keyed = groups >= 0
+        if keyed.all():
+            keyed = slice(None)
+        groups = groups[keyed]
+        group_sizes = np.bincount(groups, minlength=n_groups)
+        present = np.flatnonzero(group_sizes)
+        index = pd.MultiIndex.from_arrays([sites[present // len(periods)], periods[present % len(periods)]],
+                                          names=GROUP_KEYS)
+
+        moments = {}
+        buckets = {}
+        for column in self.columns:
+            values = df[column].to_numpy(dtype=np.float64)[keyed]
+            observed = ~np.isnan(values)
+            if observed.all():
+                count = group_sizes.astype(np.float64)
+                observed_groups, observed_values = groups, values
+            else:
+                count = np.bincount(groups, weights=observed, minlength=n_groups)
+                observed_groups, observed_values = groups[observed], values[observed]
+            minimum, maximum = np.full(n_groups, np.inf), np.full(n_groups, -np.inf)
+            np.minimum.at(minimum, observed_groups, observed_values)
+            np.maximum.at(maximum, observed_groups, observed_values)
+            minimum[count == 0] = maximum[count == 0] = np.nan
+
+            moments[(column, 'count')] = count[present]
+            moments[(column, 'sum')] = np.bincount(observed_groups, weights=observed_values, minlength=n_groups)[present]
+            moments[(column, 'sum_sq')] = np.bincount(observed_groups, weights=observed_values ** 2,
+                                                      minlength=n_groups)[present]
+            moments[(column, 'min')] = minimum[present]
+            moments[(column, 'max')] = maximum[present]
+            buckets[column] = self.count_buckets(observed_groups, observed_values, n_groups, sites, periods)
+
+        for column, labels in self.counts.items():
+            # Label position of every row (-1 for other labels), from the codes of the column's distinct values
+            codes, uniques = pd.factorize(df[column])
+            positions = np.append(pd.Index(labels).get_indexer(np.asarray(uniques).astype(str)), -1)
+            codes = positions[codes][keyed]
+            labelled = codes >= 0
+            label_counts = np.bincount(groups[labelled] * len(labels) + codes[labelled],
+                                       minlength=n_groups * len(labels)).reshape(n_groups, len(labels))
+            for i, label in enumerate(labels):
+                moments[(column, label)] = label_counts[present, i]
+
+        return self.merge_parts(pd.DataFrame(moments, index=index), buckets)
+
+    def count_buckets(self, groups:np.ndarray, values:np.ndarray, n_groups:int, sites:np.ndarray,
+                      periods:np.ndarray) -> pd.Series:
+        """
+        Number of finite values per group, sign and bucket index.
+        Returns: Pandas series indexed by (site, period_of_day, sign, bucket)
+        """
+        finite = np.isfinite(values)
+        if not finite.all():
+            groups, values = groups[finite], values[finite]
+        magnitudes = np.abs(values)
+        zero = magnitudes < MIN_SKETCH_VALUE
+        signs = (values > 0).astype(np.int64) - (values < 0)
+        indices = np.ceil(np.log(np.maximum(magnitudes, MIN_SKETCH_VALUE)) / np.log(self.gamma)).astype(np.int64)
+        if zero.any():
+            signs[zero] = 0
+            indices[zero] = 0
+
+        # One integer key per (group, sign, bucket), counted with bincount when the key range is small
+        lowest = indices.min() if len(indices) else 0
+        span = (indices.max() - lowest + 1) if len(indices) else 1
+        keys = (groups * 3 + signs + 1) * span + indices - lowest
+        n_keys = n_groups * 3 * span
+        if n_keys <= max(4 * len(keys), 1 << 20):
+            counts = np.bincount(keys, minlength=n_keys)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+
+        groups, slots = np.divmod(keys, 3 * span)
+        signs, indices = np.divmod(slots, span)
+        return pd.Series(counts, index=pd.MultiIndex.from_arrays([sites[groups // len(periods)],
+                                                                  periods[groups % len(periods)],
+                                                                  signs - 1, indices + lowest]))
+
+    def merge(self, other:"SummarySketch") -> "SummarySketch":
+        """
+        Adds another sketch of the same columns and accuracy (e.g. of another chunk or file) to this one.
+        Returns: The sketch itself
+        """
+        if other.columns != self.columns or other.gamma != self.gamma or other.counts != self.counts:
+            raise ValueError("Can only merge sketches of the same columns, counts and relative accuracy.")
+        if other.moments is None:
+            return self
+        self.n_rows += other.n_rows
+        return self.merge_parts(other.moments, other.buckets)
+
+    def merge_parts(self, moments:pd.DataFrame, buckets:dict) -> "SummarySketch":
+        """
+        Adds moments, label counts and bucket counts to the summary.
+        """
+        if self.moments is None:
+            self.moments = moments
+            self.buckets = dict(buckets)
+            return self
+
+        df = pd.concat([self.moments, moments])
+        how = {column: column[1] if column[0] in self.columns and column[1] in ('min', 'max') else 'sum'
+               for column in df.columns}
+        self.moments = df.groupby(level=[0, 1]).agg(how)
+        for column in self.columns:
+            self.buckets[column] = pd.concat([self.buckets[column], buckets[column]]).groupby(level=[0, 1, 2, 3]).sum()
+        return self
+
+    def estimate_quantiles(self, column:str) -> pd.DataFrame:
+        """
+        Approximate quantiles of a column per group, clipped to the exact min and max.
+        Returns: Pandas dataframe indexed by (site, period_of_day), one column per quantile ('25%', ...)
+        """
+        buckets = self.buckets[column]
+        signs = buckets.index.get_level_values(2).to_numpy()
+        indices = buckets.index.get_level_values(3).to_numpy()
+        # Value of each bucket: the point with the same relative distance to both bucket bounds
+        bucket_values = signs * 2 * self.gamma ** indices.astype(np.float64) / (self.gamma + 1)
+        df_buckets = pd.DataFrame({'value': bucket_values, 'count': buckets.to_numpy()},
+                                  index=buckets.index.droplevel([2, 3]))
+
+        rows = {}
+        for group, df_group in df_buckets.groupby(level=[0, 1]):
+            df_group = df_group.sort_values('value')
+            cumulative = df_group['count'].cumsum().to_numpy()
+            positions = np.searchsorted(cumulative, np.array(self.quantiles) * (cumulative[-1] - 1), side='right')
+            rows[group] = df_group['value'].to_numpy()[positions]
+
+        labels = [f"{quantile:.0%}" for quantile in self.quantiles]
+        df_quantiles = pd.DataFrame.from_dict(rows, orient='index', columns=labels)
+        df_quantiles.index = pd.MultiIndex.from_tuples(df_quantiles.index, names=GROUP_KEYS)
+        minimum, maximum = self.moments[(column, 'min')], self.moments[(column, 'max')]
+        return df_quantiles.reindex(self.moments.index).clip(lower=minimum, upper=maximum, axis=0)
+
+    def result(self) -> pd.DataFrame:
+        """
+        describe()-like statistics of every column: count, mean, std (ddof=1), min, quantiles and max,
+        followed by the label counts.
+        Returns: Pandas dataframe indexed by (site, period_of_day), with (column, statistic or label) columns
+        """
+        if self.moments is None:
+            raise ValueError("The summary is empty, update() it with some rows first.")
+
+        df_result = {}
+        for column in self.columns:
+            count = self.moments[(column, 'count')]
+            mean = self.moments[(column, 'sum')] / count
+            variance = (self.moments[(column, 'sum_sq')] - count * mean ** 2) / (count - 1)
+            df_quantiles = self.estimate_quantiles(column)
+
+            df_result[(column, 'count')] = count.astype(np.float64)
+            df_result[(column, 'mean')] = mean
+            df_result[(column, 'std')] = np.sqrt(variance.clip(lower=0))
+            df_result[(column, 'min')] = self.moments[(column, 'min')]
+            for label in df_quantiles.columns:
+                df_result[(column, label)] = df_quantiles[label]
+            df_result[(column, 'max')] = self.moments[(column, 'max')]
+        for column, labels in self.counts.items():
+            for label in labels:
+                df_result[(column, label)] = self.moments[(column, label)].astype(np.int64)
+
+        df_result = pd.DataFrame(df_result).sort_index()
+        df_result.index.names = GROUP_KEYS
+        return df_result
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+
+import joblib
+import pandas as pd
+
+# Bump when the content of the cached entries changes, so old entries are ignored
+TRAINING_CACHE_VERSION = 1
+
+# Default size bound of the cache directory
+MAX_CACHE_BYTES = 512 * 1024 ** 2
+
+
+def fingerprint_frames(*frames) -> str:
+    """
+    Content fingerprint of dataframes/series (values, dtypes, column names and index).
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for frame in frames:
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+        columns = list(frame.columns) if isinstance(frame, pd.DataFrame) else [frame.name]
+        dtypes = list(map(str, frame.dtypes)) if isinstance(frame, pd.DataFrame) else [str(frame.dtype)]
+        digest.update(json.dumps([columns, dtypes], default=str).encode())
+    return digest.hexdigest()
+
+
+def describe_param_dist(param_dist:dict) -> dict:
+    """
+    Stable description of a hyperparameter search space: scipy distributions by name and parameters,
+    lists by their values.
+    """
+    description = {}
+    for name, values in sorted(param_dist.items()):
+        if hasattr(values, 'dist') and hasattr(values, 'args'):
+            description[name] = [values.dist.name, list(values.args), values.kwds]
+        else:
+            description[name] = list(values)
+    return json.loads(json.dumps(description, default=lambda value: value.item() if hasattr(value, 'item') else str(value)))
+
+
+def candidate_key(params:dict, random_state:int) -> str:
+    """
+    Key of one evaluated hyperparameter candidate (its parameters and the forest seed).
+    """
+    params = {name: value.item() if hasattr(value, 'item') else value for name, value in params.items()}
+    return json.dumps([params, random_state], sort_keys=True)
+
+
+class TrainingCache:
+    """
+    On-disk cache of training runs, bounded to max_bytes with least recently used eviction.
+
+    Two kinds of entries:
+    - runs (run_<key>.joblib): fitted estimator, CV results and classification report of a whole training run,
+      keyed by the training data, features, search settings and seeds.
+    - candidate scores (scores_<key>.json): mean and std CV score of every evaluated hyperparameter candidate,
+      keyed by the training split and the CV setup, so searches that sample the same candidates reuse them.
+    Reading an entry marks it as recently used.
+    """
+    def __init__(self, cache_dir:str, max_bytes:int=MAX_CACHE_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, parts:dict) -> str:
+        """
+        Cache key of a JSON-serialisable description.
+        """
+        payload = json.dumps({'version': TRAINING_CACHE_VERSION, **parts}, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def path(self, kind:str, key:str) -> str:
+        """
+        File of an entry ('run' or 'scores').
+        """
+        extension = "joblib" if kind == 'run' else "json"
+        return os.path.join(self.cache_dir, f"{kind}_{key}.{extension}")
+
+    def load_run(self, key:str) -> dict:
+        """
+        Returns: Cached training run, or None if there is none
+        """
+        filepath = self.path('run', key)
+        if not os.path.exists(filepath):
+            return None
+        os.utime(filepath)
+        return joblib.load(filepath)
+
+    def save_run(self, key:str, run:dict) -> None:
+        """
+        Stores a training run, then evicts the least recently used entries beyond max_bytes.
+        """
+        self.write(self.path('run', key), lambda f: joblib.dump(run, f))
+
+    def load_scores(self, key:str) -> dict:
+        """
+        Returns: Dictionary of candidate key (see candidate_key) to (mean, std) test score
+        """
+        filepath = self.path('scores', key)
+        if not os.path.exists(filepath):
+            return {}
+        os.utime(filepath)
+        with open(filepath) as f:
+            return {candidate: tuple(scores) for candidate, scores in json.load(f).items()}
+
+    def save_scores(self, key:str, scores:dict) -> None:
+        """
+        Stores candidate scores (merged with those already cached for key).
+        """
+        scores = {**self.load_scores(key), **scores}
+        self.write(self.path('scores', key), lambda f: f.write(json.dumps(scores).encode()))
+
+    def write(self, filepath:str, dump) -> None:
+        """
+        Writes an entry atomically (temporary file renamed into place) and enforces the size bound.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(filepath + ".tmp", 'wb') as f:
+            dump(f)
+        os.replace(filepath + ".tmp", filepath)
+        self.evict(keep=filepath)
+
+    def evict(self, keep:str=None) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_bytes (keep is never removed).
+        """
+        entries = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                   if name.startswith(('run_', 'scores_')) and not name.endswith(".tmp")]
+        stats = {entry: os.stat(entry) for entry in entries}
+        total = sum(stat.st_size for stat in stats.values())
+        for entry in sorted(entries, key=lambda entry: stats[entry].st_mtime_ns):
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            os.remove(entry)
+            total -= stats[entry].st_size